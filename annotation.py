@@ -1,130 +1,360 @@
 from utils import *
+from frame_provider import frame_cache, set_cache_budget, set_prefetch_depth, prefetch_stats
+from trajectory import interpolate_keyframes
+from parallel import WorkerPool, tracker_eval_job, tracker_race_job, add_worker_counters
+from traj_cache import TrajectoryCache
+from interval_memo import IntervalMemo
+from concurrent.futures import wait, FIRST_COMPLETED
 import json
 
-def track_all_intervals(gt, cfg, interval, frame_list, is_draw):
-
-    assert len(interval) > 0, "No valid interval."
+def check_interval(gt, obj_id, cur_interval):
+    '''
+    Check if the interval can be tracked, or its result is decided without tracking
+    Input:
+        gt: the gt object generated from the xml file
+        obj_id: the id of the object to be tracked
+        cur_interval: [start, end], the interval to be checked
+    Output:
+        outcome: None if the interval need to be tracked. Otherwise ("kf_require", frame ids) if the keyframes
+                 at the ends are missing, or ("interpolated", bbox trajectory) for the interval shorter than 3 frames
+    '''
+    bbox_0 = gt.get_bbox(obj_id, cur_interval[0])
+    bbox_1 = gt.get_bbox(obj_id, cur_interval[1])
 
+    kf_require = set()
+    if len(bbox_0) == 0:
+        kf_require.add(cur_interval[0])
     
-
-    # print(frame_list)
-
-    final_interval = []
-
-    false_interval = []
-
+    if len(bbox_1) == 0:
+        kf_require.add(cur_interval[1])
+
+    if len(kf_require) > 0:
+        return ("kf_require", kf_require)
+
+    print(cur_interval)
+    # if the current interval contains less than 3 frames, then stop tracking, 
+    # Since the middle frame can be labeled by linear interpolation
+    if cur_interval[1] - cur_interval[0] <2 :
+        # Linear Interpolation
+        length = cur_interval[1] - cur_interval[0]
+        i_bbox_traj = Trajectory(interpolate_keyframes(bbox_0, bbox_1, length), start = cur_interval[0])
+        print("The result is manually labeled.")
+        return ("interpolated", i_bbox_traj)
+
+    return None
+
+def is_accepted(viou, gt_iou, viou_thresh, viou_max, gt_iou_thresh = 0.8):
+    '''
+    The rule to accept a tracker: the best viou above viou_thresh and agrees with the labeled keyframes
+    Input:
+        viou: the viou between the forward and backward tracking of the tracker
+        gt_iou: the iou with the labeled keyframes in the interval
+        viou_thresh: the minimal viou to accept a tracker
+        viou_max: the viou of the best accepted tracker so far
+        gt_iou_thresh: the minimal iou with the labeled keyframes to accept a tracker
+    '''
+    return gt_iou > gt_iou_thresh and viou >= viou_thresh and viou > viou_max
+
+def select_tracker(cur_interval, results, viou_thresh, gt_iou_thresh = 0.8):
+    '''
+    Select the best tracker of the interval from the tracking results
+    Input:
+        cur_interval: [start, end], the tracked interval
+        results: the outputs of tracker_eval (or tracker_race_eval) for all trackers, in the order of cfg["track_type"]
+        viou_thresh: the minimal viou between the forward and backward tracking to accept a tracker
+        gt_iou_thresh: the minimal iou with the labeled keyframes in the interval to accept a tracker
+    Output:
+        outcome: ("tracked", bbox trajectory) of the tracker with the best viou, or ("split", None) if no tracker is accepted
+        sub_intervals: the intervals to be tracked again if no tracker is accepted
+    '''
+    # Report the frame updates saved by aborting the trackers in the racing mode
+    if len(results) > 0 and len(results[0]) > 4:
+        n_saved = sum(result[4] for result in results)
+        n_total = 2 * (cur_interval[1] - cur_interval[0]) * len(results)
+        print(f"Racing saved {n_saved} of {n_total} frame updates in the interval {cur_interval}")
+
+    viou_max = 0
+    best = None
+    for result in results:
+        viou, ftrack, btrack, gt_iou = result[:4]
+        if is_accepted(viou, gt_iou, viou_thresh, viou_max, gt_iou_thresh):
+            best = (ftrack, btrack)
+            viou_max = viou
+
+    if best is not None:
+        # Calculate the interpolated trajectory between forward and backward tracking
+        i_bbox_traj = Trajectory(blend_tracks(best[0], best[1]), start = cur_interval[0])
+        return ("tracked", i_bbox_traj), []
+
+    # If all methods are tried and no one tracked successfully, split the interval into two halves
+    if len(results) == 0:
+        return ("split", None), []
+    mid = (cur_interval[1]+cur_interval[0])//2
+    return ("split", None), [[cur_interval[0], mid], [mid, cur_interval[1]]]
+
+def siamrpn_warmup_option(cfg):
+    '''
+    Load the SiamRPN model once per process instead of once per tracking call
+    Output:
+        siamrpn_warmup: None if SiamRPN is not used, otherwise whether to warm up the model, see preload_siamrpn
+    '''
+    if "SIAMRPN" in [tracker_name(x) for x in cfg["track_type"]]:
+        return cfg.get("siamrpn_warmup", True)
+    return None
+
+def open_traj_cache(cfg):
+    '''
+    Reuse the trajectories tracked before, also across process restarts
+    Output:
+        traj_cache: the TrajectoryCache, None if it is not enabled
+    '''
+    if cfg.get("traj_cache", False):
+        return TrajectoryCache(os.path.normpath(cfg["save_path"]) + ".traj_cache")
+    return None
+
+def start_pool(gt, cfg, frame_list):
+    '''
+    Start the worker processes to evaluate the trackers and the intervals in parallel if required. Create it once
+    and pass it to all the labeling rounds, the keyframes labeled between the rounds are sent to the workers.
+    Input:
+        gt: the gt object generated from the xml file
+        cfg: the config of the annotation
+        frame_list: the frame sequences for tracking
+    Output:
+        pool: the WorkerPool, None if cfg["num_workers"] is 0
+    '''
+    num_workers = cfg.get("num_workers", 0)
+    if num_workers == 0:
+        return None
+    return WorkerPool(gt, frame_list, num_workers, cfg.get("frame_cache_mb", 1024), siamrpn_warmup_option(cfg),
+                      cfg.get("prefetch_frames", 8), open_traj_cache(cfg))
+
+def track_objects(gt, cfg, obj_intervals, frame_list, memo = None, pool = None):
+    '''
+    Track the intervals of all the objects together
+    Input:
+        gt: the gt object generated from the xml file
+        cfg: the config of the annotation
+        obj_intervals: {obj_id: intervals}, the intervals to be tracked for each object
+        frame_list: the frame sequences for tracking
+        memo: the IntervalMemo to reuse the outcomes of the intervals whose keyframes are unchanged, None to track all
+        pool: the WorkerPool from start_pool kept across the rounds. If it is None and cfg["num_workers"] is set,
+              a pool is started for this call only. With cfg["racing"], the trackers in the workers can't abort
+              against the best tracker of the interval, see tracker_race_job
+    Output:
+        results: {obj_id: (final_interval, false_interval, i_bbox_traj, kf_require)}, the merged result of each object
+    '''
     viou_thresh = cfg["viou_thresh"]
 
-    # f_bbox_traj = {}
-    # b_bbox_traj = {}
-
     # Total number of tracker to be tried
     track_num = len(cfg["track_type"])
-    i_bbox_traj = {}
 
-    kf_require = set()
+    num_workers = cfg.get("num_workers", 0)
+    own_pool = None
+    if pool is None and num_workers > 0:
+        pool = own_pool = start_pool(gt, cfg, frame_list)
 
-    while(len(interval)>0):
-        cur_interval = interval[0]
-        interval = interval[1:]
+    if pool is not None:
+        # The workers use the trajectory cache of the pool, and load the keyframes labeled since the last round
+        traj_cache = pool.traj_cache
+        pool.sync()
+    else:
+        traj_cache = open_traj_cache(cfg)
+        siamrpn_warmup = siamrpn_warmup_option(cfg)
+        if siamrpn_warmup is not None:
+            preload_siamrpn(siamrpn_warmup)
+
+    # Run the forward and backward tracking of each tracker concurrently
+    is_concurrent = cfg.get("concurrent_direction", False)
+
+    # Track both directions of SiamRPN with batched inference
+    is_batched = cfg.get("siamrpn_batch", False)
+
+    # Abort the trackers as soon as they can't be accepted, the two directions are tracked in turns in this mode
+    is_racing = cfg.get("racing", False)
+    if is_racing and pool is not None:
+        print("Racing in the worker processes: the trackers of an interval run at the same time, so they are only aborted below viou_thresh, not against the best tracker")
+
+    # The scale of the frames each tracker runs on, a number in (0, 1] or "auto" for all the trackers,
+    # or {tracker name: scale} for each tracker
+    track_scale_cfg = cfg.get("track_scale", 1.0)
+    scales = {}
+    for tracker in cfg["track_type"]:
+        if isinstance(track_scale_cfg, dict):
+            scales[tracker] = track_scale_cfg.get(tracker_name(tracker), 1.0)
+        else:
+            scales[tracker] = track_scale_cfg
+
+    # The parameters the outcome of an interval depends on besides its keyframes
+    memo_config = (tuple(cfg["track_type"]), viou_thresh, tuple(scales[x] for x in cfg["track_type"]))
+
+    # Each interval is keyed by (depth, path, obj_id) in the bisection tree. The sorted keys of an object give
+    # the FIFO order of its serial run, so the results are merged in the same order whatever order the workers
+    # finish in. The same interval of all objects are queued together so they share the decoded frames.
+    queue = []
+    for obj_id, interval in obj_intervals.items():
+        queue += [((0, (idx,), obj_id), list(x)) for idx, x in enumerate(interval)]
+    queue.sort(key = lambda x: x[0])
+    outcomes = {}
+
+    # The running jobs {job: (key, tracker index)}, and the tracker results of the dispatched intervals
+    running = {}
+    dispatched = {}
+
+    while len(queue) > 0 or len(running) > 0:
+        # Dispatch all the intervals in the queue
+        while len(queue) > 0:
+            key, cur_interval = queue.pop(0)
+            obj_id = key[2]
+
+            outcome = check_interval(gt, obj_id, cur_interval)
+            if outcome is not None:
+                outcomes[key] = (cur_interval, outcome)
+                continue
+
+            # Reuse the outcome if the interval was decided before with the same keyframes
+            memo_result = memo.get(gt, obj_id, cur_interval, memo_config) if memo is not None else None
+            if memo_result is not None:
+                outcome, sub_intervals = memo_result
+                outcomes[key] = (cur_interval, outcome)
+                queue += [((key[0] + 1, key[1] + (idx,), obj_id), x) for idx, x in enumerate(sub_intervals)]
+                continue
+
+            # Track the interval by all selected trackers
+            if pool is None:
+                results = []
+                viou_best = 0
+                for tracker in cfg["track_type"]:
+                    if is_racing:
+                        # The later trackers only need to beat the best accepted tracker so far
+                        result = tracker_race_eval(gt, frame_list, cur_interval[0], cur_interval[1], tracker, obj_id, viou_thresh, viou_best, traj_cache = traj_cache, scale = scales[tracker])
+                    else:
+                        result = tracker_eval(gt, frame_list, cur_interval[0], cur_interval[1], tracker, obj_id, is_concurrent = is_concurrent, is_batched = is_batched, traj_cache = traj_cache, scale = scales[tracker])
+                    results.append(result)
+                    if is_accepted(result[0], result[3], viou_thresh, viou_best):
+                        viou_best = result[0]
+                outcome, sub_intervals = select_tracker(cur_interval, results, viou_thresh)
+                outcomes[key] = (cur_interval, outcome)
+                if memo is not None:
+                    memo.put(gt, obj_id, cur_interval, memo_config, outcome, sub_intervals)
+                queue += [((key[0] + 1, key[1] + (idx,), obj_id), x) for idx, x in enumerate(sub_intervals)]
+            else:
+                dispatched[key] = (cur_interval, [None] * track_num)
+                for t_idx, tracker in enumerate(cfg["track_type"]):
+                    if is_racing:
+                        # The trackers run at the same time, so they are only raced against viou_thresh
+                        job = pool.submit(tracker_race_job, cur_interval[0], cur_interval[1], tracker, obj_id, viou_thresh, scale = scales[tracker])
+                    else:
+                        job = pool.submit(tracker_eval_job, cur_interval[0], cur_interval[1], tracker, obj_id, is_concurrent = is_concurrent, is_batched = is_batched, scale = scales[tracker])
+                    running[job] = (key, t_idx)
+
+        if len(running) == 0:
+            continue
 
-        f_bbox_traj = {}
-        b_bbox_traj = {} 
+        # Wait for any tracker to finish, and decide the interval once all its trackers are finished
+        done, _ = wait(running, return_when = FIRST_COMPLETED)
+        for job in done:
+            key, t_idx = running.pop(job)
+            cur_interval, results = dispatched[key]
+            results[t_idx], counters = job.result()
+            # Count the statistics of the worker in the main process
+            add_worker_counters(counters, traj_cache)
+
+            if all(x is not None for x in results):
+                del dispatched[key]
+                # The results are checked in the order of cfg["track_type"]
+                outcome, sub_intervals = select_tracker(cur_interval, results, viou_thresh)
+                outcomes[key] = (cur_interval, outcome)
+                if memo is not None:
+                    memo.put(gt, key[2], cur_interval, memo_config, outcome, sub_intervals)
+                # The sub intervals are dispatched right away
+                queue += [((key[0] + 1, key[1] + (idx,), key[2]), x) for idx, x in enumerate(sub_intervals)]
+
+    if own_pool is not None:
+        own_pool.shutdown()
+
+    # Merge the results of each object in the FIFO order, the later trajectories overwrite the shared ends
+    merged = {obj_id: ([], [], [], set()) for obj_id in obj_intervals}
+    for key in sorted(outcomes):
+        final_interval, false_interval, i_bbox_trajs, kf_require = merged[key[2]]
+        cur_interval, (kind, value) = outcomes[key]
+        if kind == "kf_require":
+            kf_require.update(value)
+            false_interval.append(cur_interval)
+        elif kind == "interpolated":
+            false_interval.append(cur_interval)
+            i_bbox_trajs.append(value)
+        elif kind == "tracked":
+            final_interval.append(cur_interval)
+            i_bbox_trajs.append(value)
+    merged = {obj_id: (x[0], x[1], Trajectory.merge(x[2]), x[3]) for obj_id, x in merged.items()}
+    
+    # The hits and misses include the workers, the cached frames are only the ones of the main process
+    cache_stats = frame_cache.stats()
+    cached = f"{cache_stats['frames']} frames ({cache_stats['memory_mb']:.0f} MB) cached" + ("" if num_workers == 0 else " in the main process")
+    print(f"Frame cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, hit rate {cache_stats['hit_rate']:.2f}, {cached}")
 
-        bbox_0 = gt.get_bbox(cfg["obj_id"], cur_interval[0])
-        bbox_1 = gt.get_bbox(cfg["obj_id"], cur_interval[1])
-        if len(bbox_0) == 0:
-            kf_require.add(cur_interval[0])
-        
-        if len(bbox_1) == 0:
-            kf_require.add(cur_interval[1])
+    read_stats = prefetch_stats.stats()
+    if read_stats["reads"] > 0:
+        print(f"Frame prefetch: {read_stats['stalls']} stalls in {read_stats['reads']} reads ({read_stats['stall_s']:.1f} s waited), mean queue depth {read_stats['mean_depth']:.1f}")
 
-        if len(bbox_0) == 0 or len(bbox_1) == 0:
-            false_interval.append(cur_interval)
-            continue
+    if traj_cache is not None:
+        traj_cache.flush()
+        traj_stats = traj_cache.stats()
+        print(f"Trajectory cache: {traj_stats['hits']} hits, {traj_stats['misses']} misses")
 
-        print(cur_interval)
-        # if the current interval contains less than 3 frames, then stop tracking, 
-        # Since the middle frame can be labeled by linear interpolation
-        if cur_interval[1] - cur_interval[0] <2 :
-            false_interval.append(cur_interval)
-            # Linear Interpolation
-            length = cur_interval[1] - cur_interval[0]
-            
-
-            for idx in range(cur_interval[0], cur_interval[1] + 1):
-                weight = (idx - cur_interval[0])/length
-                bbox_interpolate = (bbox_0[0]*(1 - weight) + bbox_1[0]*weight,
-                        bbox_0[1]*(1 - weight) + bbox_1[1]*weight,
-                        (bbox_0[2]*(1 - weight) + bbox_1[2]*weight),
-                        (bbox_0[3]*(1 - weight) + bbox_1[3]*weight))
-
-                i_bbox_traj[idx] = bbox_interpolate
-            print("The result is manually labeled.")
-            continue
+    if memo is not None:
+        memo_stats = memo.stats()
+        print(f"Interval memo: {memo_stats['hits']} intervals reused, {memo_stats['misses']} tracked, {memo_stats['intervals']} memorized")
 
+    return merged
 
-        viou_max = 0
-        tracker_tried = 0
-        gt_iou_thresh = 0.8
-        
-        # Track the interval by all selected trackers
-        for tracker in cfg["track_type"]:
-            viou, ftrack, btrack, gt_iou = tracker_eval(gt, frame_list, cur_interval[0], cur_interval[1], tracker, cfg["obj_id"])
-            tracker_tried += 1
-            if gt_iou > gt_iou_thresh and viou >= viou_thresh and viou > viou_max:
-                # add the current interval into final interval list if hasn't done before
-                if viou_max == 0:
-                    final_interval.append(cur_interval)
+def interval_keyframes(final_interval, false_interval):
+    '''
+    Generate a set to record all manually labeled frame id
+    Input:
+        final_interval: the tracked intervals
+        false_interval: the intervals can't be tracked
+    Output:
+        keyframe: the set of the frame ids at the ends of all intervals
+    '''
+    manual_label = len(final_interval) + len(false_interval)+1
+    print(f"There are {manual_label} frames need to be manually labeled.")
+    all_interval = final_interval + false_interval
 
-                length = cur_interval[1] - cur_interval[0] + 1
+    keyframe = set()
 
-                # Calculate the interpolated trajectory between forward and backward tracking
-                i_bboxes = for_back_interpolation(ftrack, btrack)
+    for interval in all_interval:
+        keyframe.add(interval[0])
+        keyframe.add(interval[1])
 
-                for idx in range(0, length):
-                    i_bbox_traj[idx + cur_interval[0]] = i_bboxes[idx]
+    return keyframe
 
-                viou_max = viou
-            
-            else:
-                # If all methods are tried and no one tracked successfully
-                
-                if (tracker_tried == track_num) and (viou_max == 0):
-                    
-                    mid = (cur_interval[1]+cur_interval[0])//2
-                    interval.append([cur_interval[0], mid])
-                    interval.append([mid, cur_interval[1]])
-    
+def track_all_intervals(gt, cfg, interval, frame_list, is_draw, memo = None, pool = None):
 
-    # If there is no required kf
-    if len(kf_require) == 0:
-        # Generate a list to record all manually labeled frame id
-        manual_label = len(final_interval) + len(false_interval)+1
-        print(f"There are {manual_label} frames need to be manually labeled.")
-        all_interval = final_interval + false_interval
+    assert len(interval) > 0, "No valid interval."
 
-        keyframe = set()
+    obj_id = cfg["obj_id"]
 
-        for interval in all_interval:
-            keyframe.add(interval[0])
-            keyframe.add(interval[1])
+    final_interval, false_interval, i_bbox_traj, kf_require = track_objects(gt, cfg, {obj_id: interval}, frame_list, memo, pool)[obj_id]
 
-        gt_bbox_traj = gt.get_bboxes(cfg["obj_id"])
+    # If there is no required kf
+    if len(kf_require) == 0:
+        # Generate a list to record all manually labeled frame id
+        keyframe = interval_keyframes(final_interval, false_interval)
         
         if is_draw:
             # Draw the bbox to the frame
-            draw_result(frame_list, i_bbox_traj, cfg["save_path"], False, None, True, keyframe)
+            draw_result(frame_list, i_bbox_traj, cfg["save_path"], False, None, True, keyframe, cfg.get("save_frames", True))
 
         # Update the bboxes in the xml file
-        gt.update_xml(cfg["obj_id"], i_bbox_traj, True)
+        gt.update_xml(obj_id, i_bbox_traj, True)
         return kf_require, []
 
 
     else:
         # if len(cfg["intervals"]) == 1:
         #     print("initial keyframe selection.",init_keyframe_select(cfg["intervals"][0][0], cfg["intervals"][0][1]))
-        obj_id = cfg["obj_id"]
         print(f"The gt for {obj_id} in frame {kf_require} need to be labeled.")
         cfg["intervals"] = list(false_interval)
         # interval = cfg["intervals"]
@@ -133,43 +363,185 @@ def track_all_intervals(gt, cfg, interval, frame_list, is_draw):
     
         return kf_require, cfg["intervals"]
 
+def track_all_objects(gt, cfg, obj_intervals, frame_list, is_draw, memo = None, pool = None):
+    '''
+    Track the intervals of multiple objects in a single pass over the video
+    Input:
+        gt: the gt object generated from the xml file
+        cfg: the config of the annotation
+        obj_intervals: {obj_id: intervals}, the intervals to be tracked for each object
+        frame_list: the frame sequences for tracking
+        is_draw: whether draw the result of each object into <save_path>/<obj_id>
+        memo: the IntervalMemo to reuse the outcomes of the intervals whose keyframes are unchanged, None to track all
+        pool: the WorkerPool kept across the rounds, see start_pool
+    Output:
+        kf_require: {obj_id: frame ids}, the keyframes need to be labeled for each unfinished object
+        obj_intervals: {obj_id: intervals}, the intervals to be tracked again for each unfinished object
+    '''
+    assert len(obj_intervals) > 0, "No valid object."
+
+    results = track_objects(gt, cfg, obj_intervals, frame_list, memo, pool)
+
+    kf_require = {}
+    remain_intervals = {}
+
+    for obj_id in obj_intervals:
+        final_interval, false_interval, i_bbox_traj, obj_kf_require = results[obj_id]
+
+        if len(obj_kf_require) == 0:
+            keyframe = interval_keyframes(final_interval, false_interval)
+
+            if is_draw:
+                draw_result(frame_list, i_bbox_traj, os.path.join(cfg["save_path"], str(obj_id)), False, None, True, keyframe, cfg.get("save_frames", True))
+
+            # Update the bboxes of the object, the xml file is saved once for all objects
+            gt.update_xml(obj_id, i_bbox_traj, False)
+        else:
+            print(f"The gt for {obj_id} in frame {obj_kf_require} need to be labeled.")
+            kf_require[obj_id] = obj_kf_require
+            remain_intervals[obj_id] = list(false_interval)
+
+    gt.flush()
+
+    if len(remain_intervals) > 0:
+        cfg["intervals"] = {str(obj_id): intervals for obj_id, intervals in remain_intervals.items()}
+        with open(json_path, 'w') as f:
+            json.dump(cfg, f, indent=4)
+
+    return kf_require, remain_intervals
+
 if __name__ == "__main__":
 
     json_path = "/home/xhu/Code/auto_annotation/data/test/config.json"
     with open(json_path, 'r') as f:
         cfg = json.load(f)
 
-    gt = GTdata(cfg["xml_path"])
+    if cfg.get("gt_sidecar", False):
+        # Work on the binary sidecar of the xml file, the xml file is exported when the annotation is finished
+        gt = GTdata.load(cfg["xml_path"])
+    else:
+        # Only load the tracks of the annotated objects
+        load_ids = None
+        if cfg["obj_id"] != "all":
+            load_ids = cfg["obj_id"] if isinstance(cfg["obj_id"], list) else [cfg["obj_id"]]
+        gt = GTdata(cfg["xml_path"], load_ids)
+
+    if cfg.get("gt_journal", False):
+        # Append the labeled keyframes to a journal, compacted into the working copy in the background
+        gt.enable_journal(compact_interval = cfg.get("journal_compact_s", 60.0))
 
     interval = cfg["intervals"]
 
-    frame_list = frame_list_gen(cfg["img_path"])
+    # The memory budget of the decoded frame cache shared by all trackers
+    set_cache_budget(cfg.get("frame_cache_mb", 1024))
 
-    kf_require = set()
+    # The number of frames decoded ahead of the tracking on a background thread
+    set_prefetch_depth(cfg.get("prefetch_frames", 8))
 
-    while(len(interval)>0):
-        if len(kf_require) != 0:
-            add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
-            kf_require = set()
+    # The number of SiamRPN exemplar kernels reused across the intervals sharing a keyframe
+    set_kernel_cache_size(cfg.get("kernel_cache_size", 128))
 
-        kf_require, interval = track_all_intervals(gt, cfg, interval, frame_list, False)
-    
+    # Read the frames from the memory-mapped frame store instead of decoding the images in every pass
+    if cfg.get("video_path"):
+        # Decode the frames from the video file instead of the extracted images
+        frame_list = video_frame_list(cfg["video_path"])
+    else:
+        frame_list = frame_list_gen(cfg["img_path"], use_store = cfg.get("frame_store", False))
 
-        # while(not finish):
+    # Incremental mode: track the original intervals again after each labeling round, the intervals whose
+    # keyframes are unchanged reuse their outcomes, so only the intervals touched by the new keyframes are tracked
+    memo = IntervalMemo() if cfg.get("incremental", False) else None
 
-        #     if len(kf_require) != 0:
-        #         add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
-        #         kf_require = set()
+    # The worker processes are started once for all the rounds
+    pool = start_pool(gt, cfg, frame_list)
 
-    
-    # Retrack again for double check and generate the result video
-    is_finish = False
-    while not is_finish:
-        interval = cfg["original_interval"][cfg["obj_id"]]
-        kf_require, _ = track_all_intervals(gt, cfg, interval, frame_list, True)
-        if len(kf_require) == 0:
-            is_finish = True
+    # Multi-object mode, cfg["obj_id"] is a list of object ids or "all" for all tracks in the gt
+    obj_ids = cfg["obj_id"]
+    if obj_ids == "all":
+        obj_ids = list(gt.data["annotations"].keys())
+
+    if isinstance(obj_ids, list):
+        # The intervals are shared by all objects, or given per object when resumed
+        if isinstance(interval, dict):
+            obj_intervals = {int(obj_id): x for obj_id, x in interval.items()}
         else:
-            add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
-            kf_require = set()
+            obj_intervals = {obj_id: list(interval) for obj_id in obj_ids}
+
+        kf_require = {}
+
+        if memo is not None:
+            # The last round tracks the original intervals with all the keyframes labeled, so it is the double check
+            obj_intervals = {obj_id: cfg["original_interval"][obj_id] for obj_id in obj_ids}
+            while(len(obj_intervals)>0):
+                for obj_id, frame_ids in kf_require.items():
+                    add_keyframe(gt, frame_list, obj_id, frame_ids)
+                    memo.invalidate(obj_id, frame_ids)
+
+                kf_require, remain_intervals = track_all_objects(gt, cfg, obj_intervals, frame_list, True, memo, pool)
+                obj_intervals = {obj_id: obj_intervals[obj_id] for obj_id in remain_intervals}
+
+        while(len(obj_intervals)>0):
+            for obj_id, frame_ids in kf_require.items():
+                add_keyframe(gt, frame_list, obj_id, frame_ids)
+
+            kf_require, obj_intervals = track_all_objects(gt, cfg, obj_intervals, frame_list, False, pool = pool)
+
+        # Retrack again for double check and generate the result video
+        is_finish = memo is not None
+        while not is_finish:
+            obj_intervals = {obj_id: cfg["original_interval"][obj_id] for obj_id in obj_ids}
+            kf_require, _ = track_all_objects(gt, cfg, obj_intervals, frame_list, True, pool = pool)
+            if len(kf_require) == 0:
+                is_finish = True
+            else:
+                for obj_id, frame_ids in kf_require.items():
+                    add_keyframe(gt, frame_list, obj_id, frame_ids)
+
+    else:
+        kf_require = set()
+
+        if memo is not None:
+            # The last round tracks the original intervals with all the keyframes labeled, so it is the double check
+            interval = cfg["original_interval"][cfg["obj_id"]]
+            while(len(interval)>0):
+                if len(kf_require) != 0:
+                    add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
+                    memo.invalidate(cfg["obj_id"], kf_require)
+                    kf_require = set()
+
+                kf_require, remain = track_all_intervals(gt, cfg, interval, frame_list, True, memo, pool)
+                if len(remain) == 0:
+                    interval = []
+
+        while(len(interval)>0):
+            if len(kf_require) != 0:
+                add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
+                kf_require = set()
+
+            kf_require, interval = track_all_intervals(gt, cfg, interval, frame_list, False, pool = pool)
     
+
+            # while(not finish):
+
+            #     if len(kf_require) != 0:
+            #         add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
+            #         kf_require = set()
+
+    
+        # Retrack again for double check and generate the result video
+        is_finish = memo is not None
+        while not is_finish:
+            interval = cfg["original_interval"][cfg["obj_id"]]
+            kf_require, _ = track_all_intervals(gt, cfg, interval, frame_list, True, pool = pool)
+            if len(kf_require) == 0:
+                is_finish = True
+            else:
+                add_keyframe(gt, frame_list, cfg["obj_id"], kf_require)
+                kf_require = set()
+
+    if pool is not None:
+        pool.shutdown()
+
+    gt.close_journal()
+    if gt.sidecar_path is not None:
+        gt.export_xml()
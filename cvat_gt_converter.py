@@ -1,15 +1,431 @@
+import os
+import json
+import zlib
+import struct
+import threading
+import numpy as np
 import xml.dom.minidom
+import xml.etree.ElementTree as ET
+from collections.abc import Mapping, MutableMapping
+from trajectory import Trajectory
+
+# The attributes of a box
+BOX_FIELDS = ("outside", "occluded", "keyframe", "xtl", "ytl", "xbr", "ybr", "z_order")
+COORD_FIELDS = ("xtl", "ytl", "xbr", "ybr")
+TRACK_COLUMNS = ("frames", "outside", "occluded", "keyframe", "coords", "z_order", "edited")
+
+# The layout of the binary sidecar file (npz): "meta" holds the json of the gt meta data, and each track
+# is stored as the arrays "t<track_id>_<column>" for the columns in TRACK_COLUMNS
+SIDECAR_VERSION = 1
+
+class TrackColumns:
+    def __init__(self, records: list) -> None:
+        '''
+        The boxes of a track stored as columns, sorted by the frame id
+        Input:
+            records: [(frame_id, outside, occluded, keyframe, xtl, ytl, xbr, ybr, z_order)], a later record of
+                     the same frame replaces the earlier one
+        '''
+        # Keep the last record of each frame
+        records = list({x[0]: x for x in records}.values())
+        records.sort(key = lambda x: x[0])
+
+        self.frames = np.array([x[0] for x in records], dtype = np.int64)
+        self.outside = np.array([x[1] for x in records], dtype = bool)
+        self.occluded = np.array([x[2] for x in records], dtype = bool)
+        self.keyframe = np.array([x[3] for x in records], dtype = bool)
+        self.coords = np.array([x[4:8] for x in records], dtype = np.float64).reshape(-1, 4)
+        self.z_order = np.array([x[8] for x in records], dtype = np.int32)
+        # The boxes changed since the xml file was parsed
+        self.edited = np.zeros(len(self.frames), dtype = bool)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "TrackColumns":
+        '''
+        Create the columns from the arrays {column name: array}, e.g. loaded from the sidecar file
+        '''
+        columns = object.__new__(cls)
+        for name in TRACK_COLUMNS:
+            setattr(columns, name, arrays[name])
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def row(self, frame_id: int) -> int:
+        '''
+        Get the row of the frame id, -1 if the track has no box in the frame
+        '''
+        row = int(np.searchsorted(self.frames, frame_id))
+        if row < len(self.frames) and self.frames[row] == frame_id:
+            return row
+        return -1
+
+    def rows(self, start: int, end: int) -> slice:
+        '''
+        Get the rows of the frames in [start, end)
+        '''
+        return slice(int(np.searchsorted(self.frames, start)), int(np.searchsorted(self.frames, end)))
+
+    def usable(self) -> np.ndarray:
+        '''
+        The mask of the boxes which can be used as the gt, the keyframes which are not occluded
+        '''
+        return self.keyframe & ~self.occluded
+
+class BoxView(MutableMapping):
+    '''
+    The dict view of a box {attribute: value}, the writes go to the columns of the track
+    '''
+    def __init__(self, columns: TrackColumns, row: int) -> None:
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, key: str) -> object:
+        if key in COORD_FIELDS:
+            return float(self.columns.coords[self.row, COORD_FIELDS.index(key)])
+        if key == "z_order":
+            return int(self.columns.z_order[self.row])
+        if key in ("outside", "occluded", "keyframe"):
+            return bool(getattr(self.columns, key)[self.row])
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: object) -> None:
+        if key in COORD_FIELDS:
+            self.columns.coords[self.row, COORD_FIELDS.index(key)] = value
+        elif key in BOX_FIELDS:
+            getattr(self.columns, key)[self.row] = value
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError("The box attributes can't be deleted.")
+
+    def __iter__(self) -> object:
+        return iter(BOX_FIELDS)
+
+    def __len__(self) -> int:
+        return len(BOX_FIELDS)
+
+class TrackView(Mapping):
+    '''
+    The dict view of a track {frame_id: BoxView}
+    '''
+    def __init__(self, columns: TrackColumns) -> None:
+        self.columns = columns
+
+    def __getitem__(self, frame_id: int) -> BoxView:
+        row = self.columns.row(frame_id)
+        if row < 0:
+            raise KeyError(frame_id)
+        return BoxView(self.columns, row)
+
+    def __contains__(self, frame_id: int) -> bool:
+        return self.columns.row(frame_id) >= 0
+
+    def __iter__(self) -> object:
+        return iter(self.columns.frames.tolist())
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+class AnnotationView(Mapping):
+    '''
+    The dict view of all tracks {track_id: TrackView}
+    '''
+    def __init__(self, tracks: dict) -> None:
+        self.tracks = tracks
+
+    def __getitem__(self, t_id: int) -> TrackView:
+        return TrackView(self.tracks[t_id])
+
+    def __contains__(self, t_id: int) -> bool:
+        return t_id in self.tracks
+
+    def __iter__(self) -> object:
+        return iter(self.tracks)
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+# A journal record: track id, frame id, xtl, ytl, xbr, ybr, flags (bit 0: keyframe), followed by its crc32
+JOURNAL_RECORD = struct.Struct("<qqddddB")
+JOURNAL_CRC = struct.Struct("<I")
+JOURNAL_KEYFRAME = 1
+
+def read_journal(path: str) -> tuple:
+    '''
+    Read the complete records of a journal file, a torn record at the end (an interrupted append) is dropped
+    Input:
+        path: the path to the journal file
+    Output:
+        edits: [(track_id, frame_id, (xtl, ytl, xbr, ybr))], in the order they were made, empty if no file
+        valid_len: the length of the complete records in bytes
+        file_len: the length of the file in bytes
+    '''
+    if not os.path.exists(path):
+        return [], 0, 0
+    with open(path, "rb") as f:
+        data = f.read()
+
+    edits = []
+    size = JOURNAL_RECORD.size + JOURNAL_CRC.size
+    valid_len = 0
+    for offset in range(0, len(data) - size + 1, size):
+        payload = data[offset:offset + JOURNAL_RECORD.size]
+        crc = JOURNAL_CRC.unpack_from(data, offset + JOURNAL_RECORD.size)[0]
+        if crc != zlib.crc32(payload):
+            break
+        t_id, frame_id, xtl, ytl, xbr, ybr, _ = JOURNAL_RECORD.unpack(payload)
+        edits.append((t_id, frame_id, (xtl, ytl, xbr, ybr)))
+        valid_len = offset + size
+    return edits, valid_len, len(data)
+
+class EditJournal:
+    def __init__(self, journal_path: str) -> None:
+        '''
+        An append-only journal of the box edits. Each edit is a fixed size record, so appending costs the same
+        whatever the size of the annotation. The journal being compacted is renamed to <journal_path>.compacting
+        and removed once the working copy with its edits is written.
+        Input:
+            journal_path: the path to the journal file
+        '''
+        self.journal_path = journal_path
+        self.compacting_path = journal_path + ".compacting"
+        self.file = open(self.journal_path, "ab")
+
+    def append(self, edits: list) -> None:
+        '''
+        Append the edits and make them durable
+        Input:
+            edits: [(track_id, frame_id, (xtl, ytl, xbr, ybr))], the rounded bboxes marked as keyframes
+        '''
+        if len(edits) == 0:
+            return
+        data = bytearray()
+        for t_id, frame_id, bbox in edits:
+            payload = JOURNAL_RECORD.pack(t_id, frame_id, *bbox, JOURNAL_KEYFRAME)
+            data += payload + JOURNAL_CRC.pack(zlib.crc32(payload))
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def replay(self) -> list:
+        '''
+        Read the edits of the journal being compacted (left by an interrupted compaction) and the journal.
+        A torn record at the end of the journal (an interrupted append) is dropped.
+        Output:
+            edits: [(track_id, frame_id, (xtl, ytl, xbr, ybr))], in the order they were made
+        '''
+        edits = []
+        for path in (self.compacting_path, self.journal_path):
+            path_edits, valid_len, file_len = read_journal(path)
+            edits += path_edits
+
+            # Cut the torn record so the next appends follow the last complete record
+            if valid_len != file_len and path == self.journal_path:
+                self.file.truncate(valid_len)
+        return edits
+
+    def rotate(self) -> None:
+        '''
+        Start a new journal, the current one is kept as the journal being compacted
+        '''
+        self.file.close()
+        if os.path.exists(self.compacting_path):
+            # The previous compaction failed, keep its edits before the current ones
+            with open(self.compacting_path, "ab") as f, open(self.journal_path, "rb") as g:
+                f.write(g.read())
+                f.flush()
+                os.fsync(f.fileno())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.compacting_path)
+        self.file = open(self.journal_path, "ab")
+
+    def drop_compacted(self) -> None:
+        '''
+        Remove the compacted journal once its edits are written into the working copy
+        '''
+        if os.path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+
+    def close(self) -> None:
+        self.file.close()
+
+def xml_stamp(xml_path: str) -> list:
+    '''
+    The modification time and the size of the xml file, to find out if the file changed
+    '''
+    stat = os.stat(xml_path)
+    return [stat.st_mtime_ns, stat.st_size]
 
 class GTdata:
-    def __init__(self, xml_path: str) -> None:
+    def __init__(self, xml_path: str, obj_ids: list = None) -> None:
         '''
         Initialize the ground truth data from the xml file.
         Input:
             xml_path: the path to the gt file
+            obj_ids: only load the tracks of these object ids, None to load all tracks
         '''
         self.xml_path = xml_path
-        self.xml_root = self.xml_reader(self.xml_path)
-        self.data = self.xml_parser(self.xml_root)
+        self.obj_ids = None if obj_ids is None else set(obj_ids)
+        # {track_id: TrackColumns}
+        self.tracks = {}
+        self.data = self.xml_parser(self.xml_path, self.obj_ids)
+        # The xml tree is only needed to update the file, it is loaded at the first update
+        self._xml_root = None
+        # {(track_id, frame_id): [box elements]} and {track_id: track element}, built with the xml tree
+        self.box_index = None
+        self.track_index = None
+        # If the working copy has edits not written into the file yet
+        self.is_dirty = False
+        # The binary sidecar file used as the working copy instead of the xml file, see GTdata.load
+        self.sidecar_path = None
+        self.init_journal_state()
+        self.replay_journal()
+
+    def init_journal_state(self) -> None:
+        '''
+        The state of the edit journal, see enable_journal
+        '''
+        self.journal = None
+        # The journaled edits not compacted into the working copy yet
+        self.pending = []
+        # edit_lock guards the track columns, the journal and the pending edits, compact_lock guards writing the working copy
+        self.edit_lock = threading.Lock()
+        self.compact_lock = threading.RLock()
+        self.compactor = None
+        self.compactor_stop = None
+        # The journal the pending edits were replayed from when the gt was loaded, see replay_journal
+        self.replayed_path = None
+
+    @classmethod
+    def load(cls, xml_path: str, sidecar_path: str = None) -> "GTdata":
+        '''
+        Load the gt from the binary sidecar of the xml file. The sidecar is built from the xml file if it doesn't
+        exist or the xml file changed after it was built. The sidecar becomes the working copy: the edits are
+        saved into it and the xml file is only written by export_xml. All the tracks are loaded.
+        Input:
+            xml_path: the path to the gt file
+            sidecar_path: the path to the sidecar file, default to <xml_path>.gt.npz
+        Output:
+            gt: the gt object
+        '''
+        if sidecar_path is None:
+            sidecar_path = xml_path + ".gt.npz"
+
+        if os.path.exists(sidecar_path):
+            with np.load(sidecar_path) as arrays:
+                meta = json.loads(arrays["meta"].tobytes().decode("utf-8"))
+                if meta["version"] == SIDECAR_VERSION and meta["xml_stamp"] == xml_stamp(xml_path):
+                    return cls.from_sidecar(xml_path, sidecar_path, meta, arrays)
+
+        gt = cls(xml_path)
+        gt.sidecar_path = sidecar_path
+        gt.save_sidecar()
+        gt.replay_journal()
+        return gt
+
+    @classmethod
+    def from_sidecar(cls, xml_path: str, sidecar_path: str, meta: dict, arrays: dict) -> "GTdata":
+        '''
+        Create the gt object from the content of the sidecar file
+        '''
+        gt = object.__new__(cls)
+        gt.xml_path = xml_path
+        gt.obj_ids = None
+        gt.tracks = {}
+        for t_id in meta["tracks"]:
+            gt.tracks[t_id] = TrackColumns.from_arrays({name: arrays[f"t{t_id}_{name}"] for name in TRACK_COLUMNS})
+
+        gt.data = {"task_id": meta["task_id"],
+                   "vid_name": meta["vid_name"],
+                   "frame_num": meta["frame_num"],
+                   "labels": meta["labels"],
+                   "frame_size": tuple(meta["frame_size"]),
+                   "annotations": AnnotationView(gt.tracks)}
+        gt._xml_root = None
+        gt.box_index = None
+        gt.track_index = None
+        gt.is_dirty = False
+        gt.sidecar_path = sidecar_path
+        gt.init_journal_state()
+        gt.replay_journal()
+        return gt
+
+    def save_sidecar(self) -> None:
+        '''
+        Write the working copy into the sidecar file, through a temporary file renamed over the old one
+        '''
+        self.write_sidecar(self.sidecar_arrays())
+        self.is_dirty = False
+
+    def sidecar_arrays(self) -> dict:
+        '''
+        Output:
+            arrays: {name: array}, the copy of the working copy to be written into the sidecar file
+        '''
+        assert self.obj_ids is None, "The sidecar needs all the tracks to be loaded."
+        meta = {"version": SIDECAR_VERSION,
+                "xml_stamp": xml_stamp(self.xml_path),
+                "task_id": self.data["task_id"],
+                "vid_name": self.data["vid_name"],
+                "frame_num": self.data["frame_num"],
+                "labels": self.data["labels"],
+                "frame_size": list(self.data["frame_size"]),
+                "tracks": list(self.tracks.keys())}
+        arrays = {"meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype = np.uint8)}
+        for t_id, columns in self.tracks.items():
+            for name in TRACK_COLUMNS:
+                arrays[f"t{t_id}_{name}"] = getattr(columns, name).copy()
+        return arrays
+
+    def write_sidecar(self, arrays: dict) -> None:
+        tmp_path = f"{self.sidecar_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.sidecar_path)
+
+    @property
+    def xml_root(self) -> object:
+        if self._xml_root is None:
+            self._xml_root = self.xml_reader(self.xml_path)
+            self.build_index(self._xml_root)
+        return self._xml_root
+
+    def build_index(self, xml_root: object) -> None:
+        '''
+        Index the track and box elements of the xml tree, so an edit doesn't need to scan the tree
+        '''
+        self.track_index = {}
+        self.box_index = {}
+        for track in xml_root.getElementsByTagName('track'):
+            t_id = int(track.getAttribute("id"))
+            self.track_index.setdefault(t_id, track)
+            for item in track.getElementsByTagName('box'):
+                self.box_index.setdefault((t_id, int(item.getAttribute("frame"))), []).append(item)
+
+    def __getstate__(self) -> dict:
+        '''
+        The xml tree is only needed to update the file, don't copy it when the gt is sent to the worker processes
+        '''
+        state = self.__dict__.copy()
+        state["_xml_root"] = None
+        state["box_index"] = None
+        state["track_index"] = None
+        # The journal is only written by the process which owns it
+        for key in ("journal", "edit_lock", "compact_lock", "compactor", "compactor_stop"):
+            state[key] = None
+        state["pending"] = []
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.edit_lock = threading.Lock()
+        self.compact_lock = threading.RLock()
 
     def get_bbox(self, obj_id: int = 0, frame_id: int = 0) -> tuple:
         '''
@@ -20,23 +436,13 @@ class GTdata:
         Output:
             bbox: the location of the bbox, tuple (xtl, ytl, xbr, ybr). Return empty tuple if the required bbox is not exist
         '''
-        cur = self.data
-
-        # Check if the annotation exists
-        if "annotations" in cur:
-            cur = cur["annotations"]
-            
-            # Check if the object exists
-            if obj_id in cur:
-                cur = cur[obj_id]
-                
-                # Check if the frame exists
-                if frame_id in cur:
-                    cur = cur[frame_id]
-                    if (not cur["occluded"]) and cur["keyframe"]:
-                        bbox = (cur["xtl"], cur["ytl"], cur["xbr"], cur["ybr"])
-                        return bbox
-        
+        # Check if the object and the frame exist
+        columns = self.tracks.get(obj_id)
+        if columns is not None:
+            row = columns.row(frame_id)
+            if row >= 0 and (not columns.occluded[row]) and columns.keyframe[row]:
+                return tuple(columns.coords[row].tolist())
+
         return ()
 
     def get_bboxes(self, obj_id: int = 0, start: int = 0, end: int = -1) -> list:
@@ -47,9 +453,8 @@ class GTdata:
             start: the frame id to start
             end: the frame id to end, - represent to select from the end side. end is not included
         Output:
-            bboxes: list[(xtl, ytl, xbr, ybr)], the bbox trajectory
+            bboxes: the Trajectory of the bboxes from start, () for the frames without a usable keyframe
         '''
-        bboxes = []
         frame_num = self.data["frame_num"]
 
         assert start < frame_num and abs(end) <= frame_num, "Index out of the range."
@@ -57,12 +462,36 @@ class GTdata:
         if end < 0:
             end = frame_num + end +1
 
-        # print(start, end)
-        for idx in range(start, end):
-            bbox = self.get_bbox(obj_id, idx)
-            bboxes.append(bbox)
+        bboxes = np.full((max(end - start, 0), 4), np.nan)
+        columns = self.tracks.get(obj_id)
+        if columns is not None:
+            # Scatter the usable keyframes in the range into their frames
+            rows = columns.rows(start, end)
+            usable = columns.usable()[rows]
+            bboxes[columns.frames[rows][usable] - start] = columns.coords[rows][usable]
 
-        return bboxes
+        return Trajectory(bboxes, start = start)
+
+    def keyframe_mask(self, obj_id: int = 0, start: int = 0, end: int = -1) -> np.ndarray:
+        '''
+        Get the mask of the frames with a usable keyframe (a keyframe not occluded)
+        Input:
+            obj_id: the object id
+            start: the frame id to start
+            end: the frame id to end, - represent to select from the end side. end is not included
+        Output:
+            mask: (end - start,) bool array
+        '''
+        frame_num = self.data["frame_num"]
+        if end < 0:
+            end = frame_num + end +1
+
+        mask = np.zeros(max(end - start, 0), dtype = bool)
+        columns = self.tracks.get(obj_id)
+        if columns is not None:
+            rows = columns.rows(start, end)
+            mask[columns.frames[rows][columns.usable()[rows]] - start] = True
+        return mask
 
     def xml_reader(self, xml_path:str) ->object:
         '''
@@ -77,11 +506,13 @@ class GTdata:
 
         return root
 
-    def xml_parser(self, xml_root:object) -> dict:
+    def xml_parser(self, xml_path:str, obj_ids:set = None) -> dict:
         '''
-        Read the data from an xml tree and generate a dictionary
+        Stream the xml file and generate a dictionary. The boxes are stored as the columns of each track in
+        self.tracks and every parsed element is discarded, so the whole tree is never held in memory.
         Input:
-            xml_root: the root of the xml tree
+            xml_path: the path to the gt file
+            obj_ids: only load the tracks of these object ids, None to load all tracks
         Output:
             data: the generated dictionary data
 
@@ -103,133 +534,376 @@ class GTdata:
         --------ybr: float, the y value for the bottom right corner of the bbox
         --------z_order: int, not sure but keep it.
         '''
-
-        # Get the root node of the tree ('annotations' in gt file)
-        root = xml_root
-        
         # The dict to store all the infos
         data = {}
-
-        # Get the root node for the task
-        task_node = root.getElementsByTagName('meta')[0].getElementsByTagName('task')[0]
-
-        # Get the task id
-        task_id = int(task_node.getElementsByTagName('id')[0].childNodes[0].nodeValue)
-        data["task_id"] = task_id
-
-        # Get the video name
-        vid_name = task_node.getElementsByTagName('name')[0].childNodes[0].nodeValue
-        data["vid_name"] = vid_name
-
-        # Get the size of video (number of frames)
-        frame_num = int(task_node.getElementsByTagName('size')[0].childNodes[0].nodeValue)
-        data["frame_num"] = frame_num
-
-        # Get the labels name
         labels = []
-        labels_node = task_node.getElementsByTagName('labels')[0].getElementsByTagName('label')
-
-        for label in labels_node:
-            label_name = label.getElementsByTagName('name')[0].childNodes[0].nodeValue
-            labels.append(label_name)
+        root = None
 
-        data["labels"] = labels
+        for event, elem in ET.iterparse(xml_path, events = ("start", "end")):
+            if event == "start":
+                # The root node of the tree ('annotations' in gt file)
+                if root is None:
+                    root = elem
+                continue
 
-        # Get the frame size
-        size_node = task_node.getElementsByTagName('original_size')[0]
-        f_width = float(size_node.getElementsByTagName('width')[0].childNodes[0].nodeValue)
-        f_height = float(size_node.getElementsByTagName('height')[0].childNodes[0].nodeValue)
-        data["frame_size"] = (f_width, f_height)
+            if elem.tag == "meta":
+                # Get the root node for the task
+                task_node = elem.find("task")
+
+                # Get the task id, the video name and the size of video (number of frames)
+                data["task_id"] = int(task_node.find("id").text)
+                data["vid_name"] = task_node.find("name").text
+                data["frame_num"] = int(task_node.find("size").text)
+
+                # Get the labels name
+                for label in task_node.find("labels").findall("label"):
+                    labels.append(label.find("name").text)
+                data["labels"] = labels
+
+                # Get the frame size
+                size_node = task_node.find("original_size")
+                f_width = float(size_node.find("width").text)
+                f_height = float(size_node.find("height").text)
+                data["frame_size"] = (f_width, f_height)
+
+                root.clear()
+
+            elif elem.tag == "track":
+                assert "frame_size" in data, "The meta data must come before the tracks."
+
+                # Get the label of the tracker
+                t_label = elem.get("label")
+                t_id = int(elem.get("id"))
+                labels[t_id] = t_label
+
+                # Store the trajectory data of the tracker
+                if obj_ids is None or t_id in obj_ids:
+                    records = []
+                    for item in elem.iter("box"):
+                        xtl = max(0.0, min(float(item.get("xtl")), f_width))
+                        ytl = max(0.0, min(float(item.get("ytl")), f_height))
+                        xbr = max(0.0, min(float(item.get("xbr")), f_width))
+                        ybr = max(0.0, min(float(item.get("ybr")), f_height))
+                        records.append((int(item.get("frame")),
+                                        int(item.get("outside")) != 0,
+                                        int(item.get("occluded")) != 0,
+                                        int(item.get("keyframe")) != 0,
+                                        xtl, ytl, xbr, ybr,
+                                        int(item.get("z_order"))))
+                    self.tracks[t_id] = TrackColumns(records)
+
+                # Discard the parsed track
+                root.clear()
 
         # Get the annotation data
-        data["annotations"] = {}
-
-        track_nodes = root.getElementsByTagName('track')
-        for track in track_nodes:
-            # Get the label of the tracker
-            t_label = track.getAttribute("label")
-            t_id = int(track.getAttribute("id"))
-            labels[t_id] = t_label
-
-            # Store the trajectory data of the tracker
-            t_data_dict = {}
-
-            t_data = track.getElementsByTagName('box')
-            for item in t_data:
-                frame_id = int(item.getAttribute("frame"))
-                outside=False if int(item.getAttribute("outside")) == 0 else True
-                occluded=False if int(item.getAttribute("occluded")) == 0 else True 
-                keyframe=False if int(item.getAttribute("keyframe")) == 0 else True 
-                xtl=float(item.getAttribute("xtl")) 
-                ytl=float(item.getAttribute("ytl")) 
-                xbr=float(item.getAttribute("xbr"))  
-                ybr=float(item.getAttribute("ybr"))
-                xtl = max(0.0, min(xtl, f_width))
-                ytl = max(0.0, min(ytl, f_height))
-                xbr = max(0.0, min(xbr, f_width))
-                ybr = max(0.0, min(ybr, f_height))
-
-
-                z_order=int(item.getAttribute("z_order"))
-
-                t_data_dict[frame_id] = {"outside":outside,
-                                        "occluded":occluded,
-                                        "keyframe":keyframe,
-                                        "xtl":xtl,
-                                        "ytl":ytl,
-                                        "xbr":xbr,
-                                        "ybr":ybr,
-                                        "z_order":z_order}
-
-            data["annotations"][t_id] = t_data_dict
+        data["annotations"] = AnnotationView(self.tracks)
 
         return data
 
     def update_xml(self, obj_id: int, bbox_traj: dict, is_save:bool = False) -> None:
         '''
+        Update the bboxes of the object in the xml tree and mark them as keyframes
+        Input:
+            obj_id: the id of the object to be updated
+            bbox_traj: {frame_id: (xtl, ytl, xbr, ybr)} or a Trajectory, the new bboxes
+            is_save: whether to write the xml file after updating, call flush to write several updates at once
+        '''
+        self.update_boxes({(obj_id, frame_id): bbox for frame_id, bbox in bbox_traj.items()})
+
+        if is_save:
+            self.flush()
 
+    def update_boxes(self, edits: dict) -> None:
         '''
-        track_nodes = self.xml_root.getElementsByTagName('track')
-        obj_node = None
-        for track in track_nodes:
-            t_id = int(track.getAttribute("id"))
-            if t_id == obj_id:
-                obj_node = track
-                break
-        
-        assert obj_node is not None, "Can't find the object when updating."
-
-        t_data = obj_node.getElementsByTagName('box')
-        for item in t_data:
-            frame_id = int(item.getAttribute("frame"))
-
-            # If the current frame has new data to update
-            if frame_id in bbox_traj:
-                bbox = bbox_traj[frame_id]
-                xtl = round(min(max(bbox[0], 0), self.data["frame_size"][0]), 2)
-                ytl = round(min(max(bbox[1], 0), self.data["frame_size"][1]), 2)
-                xbr = round(min(max(bbox[2], 0), self.data["frame_size"][0]), 2)
-                ybr = round(min(max(bbox[3], 0), self.data["frame_size"][1]), 2)
-                item.setAttribute("xtl", str(xtl))
-                item.setAttribute("ytl", str(ytl))
-                item.setAttribute("xbr", str(xbr))
-                item.setAttribute("ybr", str(ybr))
-                item.setAttribute("keyframe", "1")
-
-                # update the data
-                self.data["annotations"][t_id][frame_id]["xtl"] = xtl
-                self.data["annotations"][t_id][frame_id]["ytl"] = ytl
-                self.data["annotations"][t_id][frame_id]["xbr"] = xbr
-                self.data["annotations"][t_id][frame_id]["ybr"] = ybr
-                self.data["annotations"][t_id][frame_id]["keyframe"] = True
-            else:
-                continue
-            
+        Apply many box edits to the working copy (the xml tree, or the sidecar data) and mark the boxes as keyframes.
+        The file is written by flush. With the edit journal, the edits are appended to the journal instead and
+        written into the working copy by the compaction.
+        Input:
+            edits: {(obj_id, frame_id): (xtl, ytl, xbr, ybr)}, the new bboxes. The frames without a box in the
+                   track are skipped.
+        '''
+        # The sidecar holds all the tracks, the xml tree is only updated without the sidecar
+        is_xml = self.sidecar_path is None
+        if is_xml:
+            # Load the xml tree and its index if not loaded yet
+            self.xml_root
+
+        for t_id in set(x[0] for x in edits):
+            assert t_id in (self.track_index if is_xml else self.tracks), "Can't find the object when updating."
+
+        f_width, f_height = self.data["frame_size"]
+        journaled = []
+        # The compaction snapshots the columns under edit_lock, so the columns and the journal are updated together
+        with self.edit_lock:
+            for (t_id, frame_id), bbox in edits.items():
+                columns = self.tracks.get(t_id)
+                row = columns.row(frame_id) if columns is not None else -1
+                items = self.box_index.get((t_id, frame_id)) if is_xml else None
+
+                # If the current frame has no box to update
+                if items is None and row < 0:
+                    continue
+
+                xtl = round(min(max(bbox[0], 0), f_width), 2)
+                ytl = round(min(max(bbox[1], 0), f_height), 2)
+                xbr = round(min(max(bbox[2], 0), f_width), 2)
+                ybr = round(min(max(bbox[3], 0), f_height), 2)
+                if self.journal is not None:
+                    journaled.append((t_id, frame_id, (xtl, ytl, xbr, ybr)))
+                else:
+                    for item in items or []:
+                        self.set_box_element(item, (xtl, ytl, xbr, ybr))
+
+                # update the data, if the track is loaded
+                if row >= 0:
+                    columns.coords[row] = (xtl, ytl, xbr, ybr)
+                    columns.keyframe[row] = True
+                    columns.edited[row] = True
+
+                self.is_dirty = True
+
+            if self.journal is not None:
+                self.journal.append(journaled)
+                self.pending.extend(journaled)
+
+    def set_box_element(self, item: object, bbox: tuple) -> None:
+        '''
+        Write the rounded bbox into the box element and mark it as a keyframe
+        '''
+        item.setAttribute("xtl", str(bbox[0]))
+        item.setAttribute("ytl", str(bbox[1]))
+        item.setAttribute("xbr", str(bbox[2]))
+        item.setAttribute("ybr", str(bbox[3]))
+        item.setAttribute("keyframe", "1")
 
-        
-        path = self.xml_path
-        with open(path, "w") as f:
+    def flush(self) -> None:
+        '''
+        Write the working copy (the sidecar or the xml file) if there are edits not written yet
+        '''
+        # The journaled edits are already durable, the compaction writes them
+        if self.journal is not None:
+            return
+        if self.is_dirty:
+            if self.sidecar_path is not None:
+                self.save_sidecar()
+            else:
+                # The edits replayed from a journal are not in the xml tree yet
+                self.xml_root
+                for t_id, frame_id, bbox in self.pending:
+                    for item in self.box_index.get((t_id, frame_id), []):
+                        self.set_box_element(item, bbox)
+                self.save_xml()
+            self.drop_replayed_journal()
+
+    def save_xml(self, path: str = None) -> None:
+        '''
+        Write the xml tree into the xml file. The tree is written into a temporary file first and then renamed,
+        so the xml file is never left half written.
+        Input:
+            path: the path to write, default to the xml file of the gt
+        '''
+        if path is None:
+            path = self.xml_path
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
             self.xml_root.writexml(f, addindent=' ', newl='')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if self.sidecar_path is None:
+            self.is_dirty = False
+
+    def replay_journal(self, journal_path: str = None) -> int:
+        '''
+        Apply the edits left in the journal of the working copy by a run which stopped before compacting them,
+        so the loaded gt holds the latest boxes. The files are not changed here: the edits stay pending and the
+        next write of the working copy (flush, or the compaction once the journal is enabled) writes them and
+        removes the journal.
+        Input:
+            journal_path: the path to the journal file, default to <working copy path>.journal
+        Output:
+            num: the number of the replayed edits
+        '''
+        if journal_path is None:
+            journal_path = (self.sidecar_path or self.xml_path) + ".journal"
+        edits = read_journal(journal_path + ".compacting")[0] + read_journal(journal_path)[0]
+        if len(edits) == 0:
+            return 0
+
+        self.apply_edits(edits)
+        self.pending.extend(edits)
+        self.replayed_path = journal_path
+        self.is_dirty = True
+        return len(edits)
+
+    def apply_edits(self, edits: list) -> None:
+        '''
+        Apply the journaled edits to the loaded tracks. The edits of the tracks not loaded (see obj_ids) are
+        still written into the xml file, but they can't be applied to the loaded data.
+        Input:
+            edits: [(track_id, frame_id, (xtl, ytl, xbr, ybr))], in the order they were made
+        '''
+        skipped = set()
+        with self.edit_lock:
+            for t_id, frame_id, bbox in edits:
+                columns = self.tracks.get(t_id)
+                if columns is None:
+                    skipped.add(t_id)
+                    continue
+                row = columns.row(frame_id)
+                if row >= 0:
+                    columns.coords[row] = bbox
+                    columns.keyframe[row] = True
+                    columns.edited[row] = True
+
+        if len(skipped) > 0:
+            print(f"The journaled edits of the tracks {sorted(skipped)} are not applied, the tracks are not loaded")
+
+    def drop_replayed_journal(self) -> None:
+        '''
+        Remove the journal the pending edits were replayed from, once they are written into the working copy
+        '''
+        if self.replayed_path is None:
+            return
+        for path in (self.replayed_path + ".compacting", self.replayed_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.replayed_path = None
+        self.pending = []
+
+    def enable_journal(self, journal_path: str = None, compact_interval: float = 60.0) -> None:
+        '''
+        Append the edits to a journal instead of rewriting the working copy (the sidecar or the xml file) at each
+        flush. Every update is durable once update_boxes returns, and a background thread compacts the journal
+        into the working copy every compact_interval seconds. The edits left in the journal by a crash were
+        replayed when the gt was loaded, the edits of another journal path are replayed here.
+        Input:
+            journal_path: the path to the journal file, default to <working copy path>.journal
+            compact_interval: the seconds between two compactions, 0 to only compact in close_journal
+        '''
+        assert self.journal is None, "The journal is already enabled."
+        if journal_path is None:
+            journal_path = (self.sidecar_path or self.xml_path) + ".journal"
+        self.journal = EditJournal(journal_path)
+        # Load the xml tree before the compaction thread may need it
+        if self.sidecar_path is None:
+            self.xml_root
+
+        # The edits not compacted before the last run stopped, the journal of the working copy was replayed by the load
+        replayed = self.journal.replay()
+        if journal_path != self.replayed_path:
+            self.apply_edits(replayed)
+            self.pending = replayed
+        # The compaction writes the pending edits and removes the journal from now on
+        self.replayed_path = None
+
+        if compact_interval > 0:
+            self.compactor_stop = threading.Event()
+            self.compactor = threading.Thread(target = self.compact_loop, args = (compact_interval,), daemon = True)
+            self.compactor.start()
+
+    def compact_loop(self, compact_interval: float) -> None:
+        while not self.compactor_stop.wait(compact_interval):
+            self.compact()
+
+    def compact(self) -> int:
+        '''
+        Write the journaled edits into the working copy and start a new journal
+        Output:
+            num: the number of the compacted edits
+        '''
+        with self.compact_lock:
+            # Take the edits and the data to be written, the new edits go to the new journal meanwhile
+            with self.edit_lock:
+                if len(self.pending) == 0 and not os.path.exists(self.journal.compacting_path):
+                    return 0
+                edits, self.pending = self.pending, []
+                self.journal.rotate()
+                arrays = self.sidecar_arrays() if self.sidecar_path is not None else None
+
+            if arrays is not None:
+                self.write_sidecar(arrays)
+            else:
+                # Load the xml tree and its index if not loaded yet
+                self.xml_root
+                for t_id, frame_id, bbox in edits:
+                    for item in self.box_index.get((t_id, frame_id), []):
+                        self.set_box_element(item, bbox)
+                self.save_xml()
+            self.journal.drop_compacted()
+            return len(edits)
+
+    def close_journal(self) -> None:
+        '''
+        Stop the background compaction, compact the remaining edits and close the journal
+        '''
+        if self.journal is None:
+            return
+        if self.compactor is not None:
+            self.compactor_stop.set()
+            self.compactor.join()
+            self.compactor = None
+        self.compact()
+        self.journal.close()
+        self.journal = None
+        self.is_dirty = False
+
+    def export_xml(self, path: str = None, verify: bool = True) -> None:
+        '''
+        Export the working copy into the CVAT xml file. The edited boxes are written into the original xml tree,
+        so all the other elements and attributes are kept as they are.
+        Input:
+            path: the path to the exported xml file, default to the xml file of the gt
+            verify: parse the exported file again and check it holds the same data as the working copy
+        '''
+        if path is None:
+            path = self.xml_path
+
+        # Don't write the xml tree while the compaction is updating it
+        with self.compact_lock:
+            # Load the xml tree and its index if not loaded yet
+            self.xml_root
+
+            for t_id, columns in self.tracks.items():
+                for row in np.flatnonzero(columns.edited).tolist():
+                    for item in self.box_index.get((t_id, int(columns.frames[row])), []):
+                        self.set_box_element(item, tuple(columns.coords[row].tolist()))
+            self.save_xml(path)
+
+            if verify:
+                mismatches = self.verify_xml(path)
+                assert len(mismatches) == 0, f"The exported xml doesn't match the gt: {mismatches[:10]}"
+
+            # The sidecar is built from the xml file it was exported to
+            if self.sidecar_path is not None and path == self.xml_path:
+                self.save_sidecar()
+                if self.journal is None:
+                    self.drop_replayed_journal()
+
+    def verify_xml(self, xml_path: str) -> list:
+        '''
+        Compare the data parsed from the xml file with the gt
+        Input:
+            xml_path: the path to the xml file
+        Output:
+            mismatches: the description of the different data, empty if the same
+        '''
+        other = GTdata(xml_path)
+        mismatches = []
+        for key in ("task_id", "vid_name", "frame_num", "labels", "frame_size"):
+            if other.data[key] != self.data[key]:
+                mismatches.append(key)
+
+        if set(other.tracks) != set(self.tracks):
+            mismatches.append("tracks")
+
+        for t_id in set(other.tracks) & set(self.tracks):
+            for name in TRACK_COLUMNS:
+                # The edit state is not a part of the xml file
+                if name != "edited" and not np.array_equal(getattr(other.tracks[t_id], name), getattr(self.tracks[t_id], name)):
+                    mismatches.append(f"track {t_id} {name}")
+
+        return mismatches
 
 
 
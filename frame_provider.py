@@ -0,0 +1,762 @@
+import os
+import cv2
+import json
+import time
+import queue
+import shutil
+import struct
+import threading
+import subprocess
+import numpy as np
+from collections import OrderedDict
+
+class FrameCache:
+    def __init__(self, max_bytes: int = 1024 << 20) -> None:
+        '''
+        A memory-budgeted LRU cache of the decoded frames, keyed by the path to the image.
+        The cached frames are shared by all the readers, so they must not be modified in place.
+        Input:
+            max_bytes: the memory budget of the cache in bytes, 0 disables the cache
+        '''
+        self.max_bytes = max_bytes
+        self.cur_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> object:
+        '''
+        Get the decoded frame from the cache, the frame is decoded and cached if it is not cached yet
+        Input:
+            path: the path to the image frame
+        Output:
+            frame: the decoded frame, None if the image can't be read
+        '''
+        with self.lock:
+            frame = self.frames.get(path)
+            if frame is not None:
+                self.frames.move_to_end(path)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        frame = cv2.imread(path)
+        if frame is not None:
+            self.put(path, frame)
+        return frame
+
+    def find(self, key: object) -> object:
+        '''
+        Get the frame from the cache without decoding it on a miss
+        Input:
+            key: the key of the frame
+        Output:
+            frame: the cached frame, None if it is not cached
+        '''
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return frame
+
+    def put(self, key: object, frame: object) -> None:
+        '''
+        Add a decoded frame into the cache and evict the least recently used frames if over the budget
+        Input:
+            key: the key of the frame, normally the path to the image
+            frame: the decoded frame
+        '''
+        # The frame is larger than the whole budget, don't cache it
+        if frame.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.frames:
+                self.cur_bytes -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.cur_bytes += frame.nbytes
+
+            while self.cur_bytes > self.max_bytes:
+                _, old_frame = self.frames.popitem(last = False)
+                self.cur_bytes -= old_frame.nbytes
+
+    def resize(self, max_bytes: int) -> None:
+        '''
+        Change the memory budget of the cache
+        Input:
+            max_bytes: the new memory budget in bytes
+        '''
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.cur_bytes > self.max_bytes:
+                _, old_frame = self.frames.popitem(last = False)
+                self.cur_bytes -= old_frame.nbytes
+
+    def clear(self) -> None:
+        '''
+        Remove all the frames from the cache and reset the counters
+        '''
+        with self.lock:
+            self.frames.clear()
+            self.cur_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def counters(self) -> dict:
+        '''
+        Output:
+            counters: the hit and miss counts, which can be added up across the processes
+        '''
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def add_counters(self, counters: dict) -> None:
+        '''
+        Add the hit and miss counts of the frame cache in another process, e.g. a worker of the process pool
+        '''
+        with self.lock:
+            self.hits += counters["hits"]
+            self.misses += counters["misses"]
+
+    def stats(self) -> dict:
+        '''
+        Output:
+            stats: the hit and miss counts, the number of cached frames and the memory used in MB
+        '''
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / total if total > 0 else 0.0,
+                    "frames": len(self.frames),
+                    "memory_mb": self.cur_bytes / float(1 << 20)}
+
+# The frame cache shared by all the trackers and directions in the process
+frame_cache = FrameCache()
+
+def set_cache_budget(max_mb: int) -> None:
+    '''
+    Set the memory budget of the shared frame cache
+    Input:
+        max_mb: the memory budget in MB, 0 disables the cache
+    '''
+    frame_cache.resize(int(max_mb) << 20)
+
+def read_frame(frame_list: list, idx: int) -> object:
+    '''
+    Read a frame from the frame sequence. Paths are decoded through the shared frame cache,
+    the lazy frame sequences (e.g. FrameStore, VideoFrames) return the frame directly.
+    Input:
+        frame_list: the list of path to the image frames, or a lazy frame sequence
+        idx: the index of the frame in the list
+    Output:
+        frame: the decoded frame, None if the frame can't be read. The frame is shared, copy it before drawing on it.
+    '''
+    item = frame_list[idx]
+    if isinstance(item, str):
+        return frame_cache.get(item)
+    return item
+
+def read_scaled_frame(frame_list: list, idx: int, scale: float = 1.0) -> object:
+    '''
+    Read a frame resized by the scale. The resized frames are kept in the shared frame cache, so the trackers
+    and the directions using the same scale resize each frame once.
+    Input:
+        frame_list: the list of path to the image frames, or a lazy frame sequence
+        idx: the index of the frame in the list
+        scale: the ratio of the resized frame to the original frame
+    Output:
+        frame: the resized frame, None if the frame can't be read. The frame is shared, copy it before drawing on it.
+    '''
+    if scale == 1.0:
+        return read_frame(frame_list, idx)
+
+    key = ("scaled", scale, frame_key(frame_list, idx))
+    frame = frame_cache.find(key)
+    if frame is None:
+        frame = read_frame(frame_list, idx)
+        if frame is not None:
+            dim = (max(int(frame.shape[1] * scale + 0.5), 1), max(int(frame.shape[0] * scale + 0.5), 1))
+            frame = cv2.resize(frame, dim, interpolation = cv2.INTER_AREA)
+            frame_cache.put(key, frame)
+    return frame
+
+def frame_name(frame_list: list, idx: int) -> str:
+    '''
+    Get the file name of the frame in the frame sequence
+    Input:
+        frame_list: the list of path to the image frames, or a lazy frame sequence
+        idx: the index of the frame in the list
+    Output:
+        name: the file name of the frame
+    '''
+    if isinstance(frame_list, (list, tuple)):
+        return os.path.basename(frame_list[idx])
+    return frame_list.name(idx)
+
+def frame_key(frame_list: list, idx: int) -> object:
+    '''
+    Get a key which identifies the frame across the frame sequences, e.g. for caching the results computed from it
+    Input:
+        frame_list: the list of path to the image frames, or a lazy frame sequence
+        idx: the index of the frame in the list
+    Output:
+        key: the path to the image, or (path to the frame sequence file, file name of the frame)
+    '''
+    if isinstance(frame_list, (list, tuple)):
+        return frame_list[idx]
+    return (frame_list.source_path, frame_list.name(idx))
+
+class PrefetchStats:
+    def __init__(self) -> None:
+        '''
+        The statistics of the prefetching readers, used to size the prefetch depth. A stall is a read which had
+        to wait for the background thread, i.e. the decoding didn't keep up with the tracking.
+        '''
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.reads = 0
+            self.stalls = 0
+            self.stall_time = 0.0
+            self.depth_total = 0
+
+    def add(self, depth: int, stall_time: float) -> None:
+        '''
+        Record a read
+        Input:
+            depth: the number of frames ready in the queue before the read
+            stall_time: the seconds waited for the frame, 0 if it was ready
+        '''
+        with self.lock:
+            self.reads += 1
+            self.depth_total += depth
+            if depth == 0:
+                self.stalls += 1
+                self.stall_time += stall_time
+
+    def counters(self) -> dict:
+        '''
+        Output:
+            counters: the totals of the reads, which can be added up across the processes
+        '''
+        with self.lock:
+            return {"reads": self.reads, "stalls": self.stalls, "stall_time": self.stall_time, "depth_total": self.depth_total}
+
+    def add_counters(self, counters: dict) -> None:
+        '''
+        Add the totals of the reads in another process, e.g. a worker of the process pool
+        '''
+        with self.lock:
+            self.reads += counters["reads"]
+            self.stalls += counters["stalls"]
+            self.stall_time += counters["stall_time"]
+            self.depth_total += counters["depth_total"]
+
+    def stats(self) -> dict:
+        '''
+        Output:
+            stats: the number of reads, stalls, the stall rate, the seconds waited and the mean queue depth
+        '''
+        with self.lock:
+            return {"reads": self.reads,
+                    "stalls": self.stalls,
+                    "stall_rate": self.stalls / self.reads if self.reads > 0 else 0.0,
+                    "stall_s": self.stall_time,
+                    "mean_depth": self.depth_total / self.reads if self.reads > 0 else 0.0}
+
+# The statistics of all the prefetching readers in the process
+prefetch_stats = PrefetchStats()
+
+# The number of frames decoded ahead by the prefetching readers, 0 reads the frames in the caller
+prefetch_depth = 8
+
+def set_prefetch_depth(depth: int) -> None:
+    '''
+    Set the number of frames decoded ahead of the tracking
+    Input:
+        depth: the maximal number of decoded frames waiting in the queue, 0 disables the prefetching
+    '''
+    global prefetch_depth
+    prefetch_depth = max(int(depth), 0)
+
+# The item put into the prefetch queue after the last frame
+PREFETCH_END = object()
+
+class PrefetchFailure:
+    def __init__(self, error: Exception) -> None:
+        '''
+        The item put into the prefetch queue when the background thread fails, the error is raised by the reader
+        '''
+        self.error = error
+
+class FramePrefetcher:
+    def __init__(self, frame_list: list, loop: list, depth: int = None, scale: float = 1.0) -> None:
+        '''
+        Read the frames in the given order on a background thread into a bounded queue, so the decoding of the
+        next frames overlaps the tracking of the current frame. The reading stops at the first frame which can't
+        be read, like the tracking does.
+        Input:
+            frame_list: the list of path to the image frames, or a lazy frame sequence
+            loop: the indices of the frames in the reading order, e.g. inversed for the backward tracking
+            depth: the maximal number of frames read ahead, default to the depth set by set_prefetch_depth
+            scale: read the frames resized by the scale, see read_scaled_frame
+        '''
+        self.frame_list = frame_list
+        self.loop = loop
+        self.scale = scale
+        self.depth = prefetch_depth if depth is None else depth
+        self.pos = 0
+        # Set once the end of the frames, an unreadable frame or a failure is read from the queue
+        self.is_done = False
+        self.thread = None
+        if self.depth > 0:
+            self.queue = queue.Queue(maxsize = self.depth)
+            self.stop = threading.Event()
+            self.thread = threading.Thread(target = self.produce, daemon = True)
+            self.thread.start()
+
+    def produce(self) -> None:
+        # Any error is passed to the reader, so it fails instead of waiting for the frames forever
+        try:
+            for idx in self.loop:
+                frame = read_scaled_frame(self.frame_list, idx, self.scale)
+                if not self.put(frame) or frame is None:
+                    return
+            self.put(PREFETCH_END)
+        except Exception as error:
+            self.put(PrefetchFailure(error))
+
+    def put(self, item: object) -> bool:
+        '''
+        Wait for the space in the queue and put the item, unless the reader is closed
+        Output:
+            is_put: False if the reader is closed
+        '''
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(self) -> object:
+        '''
+        Get the next frame in the reading order
+        Output:
+            frame: the decoded frame, None if it can't be read or all the frames are read. The error of the
+                   background thread is raised here.
+        '''
+        if self.pos >= len(self.loop) or self.is_done:
+            return None
+        self.pos += 1
+        if self.thread is None:
+            return read_scaled_frame(self.frame_list, self.loop[self.pos - 1], self.scale)
+
+        depth = self.queue.qsize()
+        timer = time.perf_counter()
+        frame = self.queue.get()
+        prefetch_stats.add(depth, time.perf_counter() - timer)
+
+        if frame is None or frame is PREFETCH_END:
+            self.is_done = True
+            return None
+        if isinstance(frame, PrefetchFailure):
+            self.is_done = True
+            raise frame.error
+        return frame
+
+    def close(self) -> None:
+        '''
+        Stop the background thread, the frames not read are dropped
+        '''
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
+
+# The layout of the frame store file:
+#   magic (8 bytes) | header length (uint32) | json header | padding | uint8 frame array (N, H, W, C)
+STORE_MAGIC = b"FRMSTORE"
+STORE_VERSION = 1
+STORE_ALIGN = 4096
+
+def read_store_header(store_path: str) -> dict:
+    '''
+    Read the header of a frame store file
+    Input:
+        store_path: the path to the frame store file
+    Output:
+        header: dict with the version, shape (N, H, W, C), the frame names in order and the offset of the frame array
+    '''
+    with open(store_path, "rb") as f:
+        magic = f.read(len(STORE_MAGIC))
+        assert magic == STORE_MAGIC, "The file is not a frame store."
+        header_len = struct.unpack("<I", f.read(4))[0]
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    assert header["version"] == STORE_VERSION, "The version of the frame store is not supported."
+    return header
+
+def build_frame_store(frame_list: list, store_path: str) -> None:
+    '''
+    Decode a sequence of image frames once into a single uint8 memory-mapped frame array on disk.
+    All the frames must have the same size.
+    Input:
+        frame_list: the list of path to the image frames, in the tracking order
+        store_path: the path to save the frame store file
+    '''
+    assert len(frame_list) > 0, "No frame to store."
+    first_frame = cv2.imread(frame_list[0])
+    assert first_frame is not None, f"Can't read the frame {frame_list[0]}"
+    shape = (len(frame_list),) + first_frame.shape
+
+    header = {"version": STORE_VERSION,
+              "shape": list(shape),
+              "frames": [os.path.basename(x) for x in frame_list]}
+    # The offset depends on the header length, reserve the space of the offset field first
+    header["offset"] = 0
+    header_len = len(json.dumps(header).encode("utf-8")) + 16
+    offset = (len(STORE_MAGIC) + 4 + header_len + STORE_ALIGN - 1) // STORE_ALIGN * STORE_ALIGN
+    header["offset"] = offset
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+    # Write into a temporary file so that an interrupted conversion never leaves a broken store
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(STORE_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        # Extend the file to the full size of the frame array
+        f.truncate(offset + int(np.prod(shape)))
+
+    data = np.memmap(tmp_path, dtype = np.uint8, mode = "r+", offset = offset, shape = shape)
+    data[0] = first_frame
+    for idx in range(1, len(frame_list)):
+        frame = cv2.imread(frame_list[idx])
+        assert frame is not None and frame.shape == first_frame.shape, f"Can't store the frame {frame_list[idx]}"
+        data[idx] = frame
+    data.flush()
+    del data
+
+    os.replace(tmp_path, store_path)
+
+class FrameStore:
+    def __init__(self, store_path: str, start: int = 0, end: int = None) -> None:
+        '''
+        A lazy, indexable frame sequence backed by a memory-mapped frame store.
+        Indexing returns a zero-copy view of the frame, slicing returns a FrameStore over the sub sequence.
+        Input:
+            store_path: the path to the frame store file generated by build_frame_store
+            start: the index of the first frame in the store
+            end: the index after the last frame in the store, None represents the end of the store
+        '''
+        self.store_path = store_path
+        self.header = read_store_header(store_path)
+        self.names = self.header["frames"]
+        self.start = start
+        self.end = len(self.names) if end is None else end
+        self.data = self.open_data()
+
+    def open_data(self) -> object:
+        '''
+        Map the frame array. The copy-on-write mode keeps the store read-only while giving writable views.
+        '''
+        return np.memmap(self.store_path, dtype = np.uint8, mode = "c",
+                         offset = self.header["offset"], shape = tuple(self.header["shape"]))
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, idx: int or slice) -> object:
+        if isinstance(idx, slice):
+            start, end, step = idx.indices(len(self))
+            assert step == 1, "Only the continuous slice is supported."
+            sub = object.__new__(FrameStore)
+            sub.__dict__.update(self.__dict__)
+            sub.start = self.start + start
+            sub.end = self.start + max(start, end)
+            return sub
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("The frame index is out of range.")
+        return np.asarray(self.data[self.start + idx])
+
+    def name(self, idx: int) -> str:
+        '''
+        Get the file name of the original image of the frame
+        '''
+        if idx < 0:
+            idx += len(self)
+        return self.names[self.start + idx]
+
+    @property
+    def source_path(self) -> str:
+        return self.store_path
+
+    def __getstate__(self) -> dict:
+        # Map the store again after unpickling instead of copying the frames
+        state = self.__dict__.copy()
+        state["data"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.data = self.open_data()
+
+# The index of a video file, saved as json next to the video
+VIDEO_INDEX_VERSION = 1
+
+def video_stamp(video_path: str) -> list:
+    '''
+    The modification time and size of the video file, the index is rebuilt when they change
+    '''
+    stat = os.stat(video_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def probe_keyframes(video_path: str) -> list:
+    '''
+    Get the timestamps of the keyframes of the video with ffprobe
+    Input:
+        video_path: the path to the video file
+    Output:
+        times: the timestamps of the keyframes in ms, None if ffprobe is not available or fails
+    '''
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    cmd = [ffprobe, "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+           "-show_entries", "frame=best_effort_timestamp_time", "-of", "csv=p=0", video_path]
+    try:
+        output = subprocess.run(cmd, capture_output = True, text = True, check = True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return [float(x.strip(",")) * 1000 for x in output.split() if x.strip(",") not in ("", "N/A")]
+
+def build_video_index(video_path: str, index_path: str, chunk_size: int = 32) -> dict:
+    '''
+    Scan the video once and save the index of the frame timestamps and the keyframes. The keyframes are the
+    positions where the decoding can start, they split the video into the chunks decoded as a whole.
+    Input:
+        video_path: the path to the video file
+        index_path: the path to save the index file
+        chunk_size: the chunk length used if the keyframes can't be probed
+    Output:
+        index: dict with the version, the stamp of the video, the frame size, fps, the timestamps in ms and
+               the keyframe ids
+    '''
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), f"Can't open the video {video_path}"
+    timestamps = []
+    # Grab without converting the frames, only the timestamps are needed
+    while cap.grab():
+        timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+    index = {"version": VIDEO_INDEX_VERSION,
+             "stamp": video_stamp(video_path),
+             "frame_size": [int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))],
+             "fps": cap.get(cv2.CAP_PROP_FPS),
+             "timestamps": timestamps}
+    cap.release()
+    assert len(timestamps) > 0, f"No frame in the video {video_path}"
+
+    # Map the keyframe timestamps to the nearest frames
+    key_times = probe_keyframes(video_path)
+    if key_times:
+        times = np.asarray(timestamps)
+        idx = np.clip(np.searchsorted(times, key_times), 1, len(times) - 1)
+        idx -= np.asarray(key_times) - times[idx - 1] < times[idx] - np.asarray(key_times)
+        keyframes = sorted(set([0] + idx.tolist()))
+    else:
+        keyframes = list(range(0, len(timestamps), chunk_size))
+    index["keyframes"] = keyframes
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index
+
+def load_video_index(video_path: str, index_path: str = None) -> dict:
+    '''
+    Load the index of the video, it is built if it doesn't exist or the video changed
+    Input:
+        video_path: the path to the video file
+        index_path: the path to the index file, default to <video_path>.index.json
+    Output:
+        index: the index of the video, see build_video_index
+    '''
+    if index_path is None:
+        index_path = video_path + ".index.json"
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if index.get("version") == VIDEO_INDEX_VERSION and index["stamp"] == video_stamp(video_path):
+            return index
+    return build_video_index(video_path, index_path)
+
+class VideoDecoder:
+    def __init__(self, video_path: str) -> None:
+        '''
+        A sequential decoder of the video with the chunk of frames decoded before the current position
+        '''
+        self.cap = cv2.VideoCapture(video_path)
+        assert self.cap.isOpened(), f"Can't open the video {video_path}"
+        # The frame id read by the next read
+        self.next_idx = 0
+        # {frame_id: frame}, the tail of the last decoded chunk, read by the backward tracking
+        self.chunk = {}
+
+    def read(self) -> object:
+        ok, frame = self.cap.read()
+        self.next_idx += 1
+        return frame if ok else None
+
+    def seek(self, idx: int) -> None:
+        if idx != self.next_idx:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            self.next_idx = idx
+
+class VideoFrames:
+    def __init__(self, video_path: str, start: int = 0, end: int = None, index_path: str = None,
+                 chunk_frames: int = 32, max_decoders: int = 2) -> None:
+        '''
+        A lazy, indexable frame sequence decoded from a video file, used in place of the list of image paths.
+        Reading the frames in order only decodes each frame once. A jump (e.g. the first frame of an interval, or
+        the last frame for the backward tracking) seeks to the keyframe before it and decodes the chunk up to it,
+        the tail of the chunk is kept so the backward tracking reads the previous frames without seeking again.
+        The decoders are shared by all the threads and the slices of the sequence behind a lock, so a prefetching
+        thread continues from the position and the chunk left by the caller (e.g. the first frame read to
+        initialize the tracker), and the forward and backward tracking use different decoders. The decoded frames
+        go through the shared frame cache.
+        Input:
+            video_path: the path to the video file
+            start: the id of the first frame in the video
+            end: the id after the last frame in the video, None represents the end of the video
+            index_path: the path to the index file, see load_video_index
+            chunk_frames: the number of frames kept from the decoded chunk for the backward reading
+            max_decoders: the number of the open decoders
+        '''
+        self.video_path = video_path
+        self.index = load_video_index(video_path, index_path)
+        self.keyframes = np.asarray(self.index["keyframes"], dtype = np.int64)
+        self.vid_name = os.path.splitext(os.path.basename(video_path))[0]
+        self.start = start
+        self.end = len(self.index["timestamps"]) if end is None else end
+        self.chunk_frames = chunk_frames
+        self.max_decoders = max_decoders
+        # The decoders, the most recently used first
+        self.decoders = []
+        self.decode_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, idx: int or slice) -> object:
+        if isinstance(idx, slice):
+            start, end, step = idx.indices(len(self))
+            assert step == 1, "Only the continuous slice is supported."
+            sub = object.__new__(VideoFrames)
+            sub.__dict__.update(self.__dict__)
+            sub.start = self.start + start
+            sub.end = self.start + max(start, end)
+            return sub
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("The frame index is out of range.")
+
+        key = (self.video_path, self.start + idx)
+        frame = frame_cache.find(key)
+        if frame is None:
+            frame = self.decode(self.start + idx)
+            if frame is not None:
+                frame_cache.put(key, frame)
+        return frame
+
+    def decode(self, frame_id: int) -> object:
+        '''
+        Decode the frame of the video
+        Input:
+            frame_id: the id of the frame in the video
+        Output:
+            frame: the decoded frame, None if it can't be decoded
+        '''
+        with self.decode_lock:
+            return self.decode_locked(frame_id)
+
+    def decode_locked(self, frame_id: int) -> object:
+        decoders = self.decoders
+
+        # The frame is in a decoded chunk, or the next frame of a decoder
+        for decoder in decoders:
+            if frame_id in decoder.chunk or decoder.next_idx == frame_id:
+                decoders.remove(decoder)
+                decoders.insert(0, decoder)
+                if frame_id in decoder.chunk:
+                    return decoder.chunk[frame_id]
+                return decoder.read()
+
+        # Jump with the least recently used decoder
+        if len(decoders) < self.max_decoders:
+            decoder = VideoDecoder(self.video_path)
+        else:
+            decoder = decoders.pop()
+        decoders.insert(0, decoder)
+
+        # Continue from the current position if it is in the same chunk before the frame
+        keyframe = int(self.keyframes[np.searchsorted(self.keyframes, frame_id, side = "right") - 1])
+        if not keyframe <= decoder.next_idx <= frame_id:
+            decoder.seek(keyframe)
+
+        # Decode up to the frame and keep the tail of the chunk
+        chunk = {}
+        frame = None
+        while decoder.next_idx <= frame_id:
+            idx = decoder.next_idx
+            frame = decoder.read()
+            if frame is None:
+                break
+            if idx > frame_id - self.chunk_frames:
+                chunk[idx] = frame
+        decoder.chunk = chunk
+        return chunk.get(frame_id)
+
+    def name(self, idx: int) -> str:
+        '''
+        Get the file name of the frame, named like the frames extracted from the video
+        '''
+        if idx < 0:
+            idx += len(self)
+        return f"{self.vid_name}_{self.start + idx:06d}.PNG"
+
+    def timestamp(self, idx: int) -> float:
+        '''
+        Get the timestamp of the frame in ms
+        '''
+        if idx < 0:
+            idx += len(self)
+        return self.index["timestamps"][self.start + idx]
+
+    @property
+    def source_path(self) -> str:
+        return self.video_path
+
+    def __getstate__(self) -> dict:
+        # The decoders are opened again by each process
+        state = self.__dict__.copy()
+        state["decoders"] = []
+        state["decode_lock"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.decode_lock = threading.Lock()
@@ -0,0 +1,80 @@
+import numpy as np
+
+class IntervalMemo:
+    def __init__(self) -> None:
+        '''
+        The decided outcomes of the tracked intervals, reused when the same interval is tracked again.
+        The outcome of an interval only depends on the gt keyframes inside it (the two ends initialize the trackers,
+        the interior keyframes are compared with the tracking result), so each outcome is stored with a snapshot of
+        them. The outcome is reused only while the snapshot is unchanged, and labeling a frame invalidates the
+        intervals containing it.
+        '''
+        # {(obj_id, start, end): (config, keyframe snapshot, outcome, sub intervals)}
+        self.entries = {}
+        # {obj_id: set of (start, end)}, to find the intervals containing a frame
+        self.obj_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self, gt: object, obj_id: int, cur_interval: list) -> tuple:
+        '''
+        Get the gt keyframes the outcome of the interval depends on
+        Input:
+            gt: the gt object generated from the xml file
+            obj_id: the id of the tracked object
+            cur_interval: [start, end], the interval
+        Output:
+            keyframes: ((frame_id, bbox)), the usable gt keyframes in the interval
+        '''
+        mask = gt.keyframe_mask(obj_id, cur_interval[0], cur_interval[1] + 1)
+        frame_ids = (np.flatnonzero(mask) + cur_interval[0]).tolist()
+        return tuple((frame_id, gt.get_bbox(obj_id, frame_id)) for frame_id in frame_ids)
+
+    def get(self, gt: object, obj_id: int, cur_interval: list, config: tuple) -> tuple:
+        '''
+        Get the memorized outcome of the interval
+        Input:
+            gt: the gt object generated from the xml file
+            obj_id: the id of the tracked object
+            cur_interval: [start, end], the interval
+            config: the tracking parameters the outcome depends on, e.g. the trackers and the thresholds
+        Output:
+            result: (outcome, sub_intervals) as returned by select_tracker, None if it must be tracked again
+        '''
+        entry = self.entries.get((obj_id, cur_interval[0], cur_interval[1]))
+        if entry is None or entry[0] != config or entry[1] != self.snapshot(gt, obj_id, cur_interval):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[2], [list(x) for x in entry[3]]
+
+    def put(self, gt: object, obj_id: int, cur_interval: list, config: tuple, outcome: tuple, sub_intervals: list) -> None:
+        '''
+        Memorize the decided outcome of the interval with the gt keyframes it depends on
+        '''
+        key = (obj_id, cur_interval[0], cur_interval[1])
+        self.entries[key] = (config, self.snapshot(gt, obj_id, cur_interval), outcome, [list(x) for x in sub_intervals])
+        self.obj_entries.setdefault(obj_id, set()).add(key[1:])
+
+    def invalidate(self, obj_id: int, frame_ids: set) -> int:
+        '''
+        Drop the outcomes of the intervals which contain the newly labeled frames
+        Input:
+            obj_id: the id of the labeled object
+            frame_ids: the labeled frame ids
+        Output:
+            num: the number of the dropped intervals
+        '''
+        spans = self.obj_entries.get(obj_id, set())
+        dropped = [x for x in spans if any(x[0] <= idx <= x[1] for idx in frame_ids)]
+        for span in dropped:
+            spans.discard(span)
+            del self.entries[(obj_id,) + span]
+        return len(dropped)
+
+    def stats(self) -> dict:
+        '''
+        Output:
+            stats: the hit and miss counts and the number of memorized intervals
+        '''
+        return {"hits": self.hits, "misses": self.misses, "intervals": len(self.entries)}
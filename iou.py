@@ -0,0 +1,106 @@
+import numpy as np
+from trajectory import Trajectory
+
+def as_boxes(bboxes: list) -> tuple:
+    '''
+    Convert the bboxes into an (N, 4) float array and the mask of the valid bboxes
+    Input:
+        bboxes: [(xtl, ytl, xbr, ybr)] where the missing bboxes are empty tuples, an (N, 4) array with NaN rows,
+                or a Trajectory (the rows are in the frame order from its start, whatever the start frame id is)
+    Output:
+        boxes: (N, 4) float64 array, the rows of the missing bboxes are NaN
+        valid: (N,) bool array, True if the bbox exists
+    '''
+    # Indexing a trajectory uses the frame ids, read its rows through the array instead
+    if isinstance(bboxes, Trajectory):
+        return np.asarray(bboxes, dtype = np.float64), bboxes.valid.copy()
+
+    if isinstance(bboxes, np.ndarray):
+        boxes = bboxes.astype(np.float64, copy = False).reshape(-1, 4)
+        return boxes, ~np.isnan(boxes).any(axis = 1)
+
+    valid = np.fromiter((len(x) == 4 for x in bboxes), dtype = bool, count = len(bboxes))
+    boxes = np.full((len(bboxes), 4), np.nan)
+    if valid.all():
+        boxes[:] = bboxes
+    elif valid.any():
+        boxes[valid] = [bboxes[idx] for idx in np.flatnonzero(valid)]
+    return boxes, valid
+
+def check_boxes(boxes: np.ndarray) -> None:
+    '''
+    Verify if the bboxes are legal, the bottom right corner must be positive
+    '''
+    assert np.all(boxes[:, 2:] > 0), "The bbox is illegal."
+
+def iou_elementwise(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    '''
+    Calculate the iou between the pairs of bboxes in the same rows
+    Input:
+        boxes_a: (N, 4) array of bboxes (xtl, ytl, xbr, ybr)
+        boxes_b: (N, 4) array of bboxes (xtl, ytl, xbr, ybr)
+    Output:
+        iou: (N,) array, 0.0 for the pairs without intersection
+    '''
+    boxes_a = np.asarray(boxes_a, dtype = np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype = np.float64).reshape(-1, 4)
+    check_boxes(boxes_a)
+    check_boxes(boxes_b)
+
+    # Calculate the intersection, it is empty if the corners are crossed
+    i_w = np.minimum(boxes_a[:, 2], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    i_h = np.minimum(boxes_a[:, 3], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    i_area = np.where((i_w > 0) & (i_h > 0), i_w * i_h, 0.0)
+
+    # Calculate the union. Union = a + b - intersection
+    a_area = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    b_area = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    u_area = a_area + b_area - i_area
+
+    iou = np.divide(i_area, u_area, out = np.zeros_like(i_area), where = i_area > 0)
+
+    # Check if the iou is legal
+    assert np.all((iou >= 0.0) & (iou <= 1.0)), "IOU is out of range."
+
+    return iou
+
+def volume_iou(boxes_a: np.ndarray, boxes_b: np.ndarray, valid: np.ndarray = None) -> tuple:
+    '''
+    Calculate the mean iou over the frames where both bboxes exist
+    Input:
+        boxes_a: (N, 4) array of bboxes, the missing bboxes are NaN rows
+        boxes_b: (N, 4) array of bboxes, the missing bboxes are NaN rows
+        valid: (N,) bool array, the frames to be compared. Default to the frames where both bboxes exist
+    Output:
+        viou: the mean iou over the compared frames, 0.0 if no frame is compared
+        num: the number of the compared frames
+    '''
+    boxes_a = np.asarray(boxes_a, dtype = np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype = np.float64).reshape(-1, 4)
+    if valid is None:
+        valid = ~(np.isnan(boxes_a).any(axis = 1) | np.isnan(boxes_b).any(axis = 1))
+
+    num = int(np.count_nonzero(valid))
+    if num == 0:
+        return 0.0, 0
+
+    iou = iou_elementwise(boxes_a[valid], boxes_b[valid])
+    return float(iou.sum()) / num, num
+
+def pairwise_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    '''
+    Calculate the iou between every bbox in boxes_a and every bbox in boxes_b
+    Input:
+        boxes_a: (N, 4) array of bboxes (xtl, ytl, xbr, ybr)
+        boxes_b: (M, 4) array of bboxes (xtl, ytl, xbr, ybr)
+    Output:
+        iou: (N, M) array
+    '''
+    boxes_a = np.asarray(boxes_a, dtype = np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype = np.float64).reshape(-1, 4)
+    n, m = len(boxes_a), len(boxes_b)
+
+    # Broadcast the pairs into (N, M) rows
+    pairs_a = np.broadcast_to(boxes_a[:, None, :], (n, m, 4)).reshape(-1, 4)
+    pairs_b = np.broadcast_to(boxes_b[None, :, :], (n, m, 4)).reshape(-1, 4)
+    return iou_elementwise(pairs_a, pairs_b).reshape(n, m)
@@ -0,0 +1,190 @@
+import os
+import pickle
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils import tracker_eval, tracker_race_eval, preload_siamrpn
+from frame_provider import frame_cache, prefetch_stats, set_cache_budget, set_prefetch_depth
+
+# The data shared by all the jobs of a worker, sent once when the worker starts
+worker_data = {}
+
+def update_path(update_dir: str, version: int) -> str:
+    '''
+    The file of the tracks changed in the version of the gt, see WorkerPool.sync
+    '''
+    return os.path.join(update_dir, f"gt.{version}.pkl")
+
+def init_worker(gt: object, frame_list: list, cache_mb: int, siamrpn_warmup: bool = None, prefetch_frames: int = 8, traj_cache: object = None, update_dir: str = None) -> None:
+    '''
+    Initialize the worker process with the data shared by all jobs
+    Input:
+        gt: the gt object generated from the xml file
+        frame_list: the frame sequences for tracking
+        cache_mb: the memory budget of the frame cache in the worker
+        siamrpn_warmup: if not None, load the SiamRPN model when the worker starts and warm it up if True
+        prefetch_frames: the number of frames decoded ahead of the tracking in the worker
+        traj_cache: the TrajectoryCache used by the jobs of the worker, None to always track
+        update_dir: the folder of the tracks changed after the worker started, see WorkerPool.sync
+    '''
+    worker_data["gt"] = gt
+    worker_data["gt_version"] = 0
+    worker_data["update_dir"] = update_dir
+    worker_data["frame_list"] = frame_list
+    worker_data["traj_cache"] = traj_cache
+    set_cache_budget(cache_mb)
+    set_prefetch_depth(prefetch_frames)
+    if siamrpn_warmup is not None:
+        preload_siamrpn(siamrpn_warmup)
+
+def sync_worker(gt_version: int) -> None:
+    '''
+    Load the tracks changed in the main process up to the version of the gt, in the order they were changed
+    '''
+    while worker_data["gt_version"] < gt_version:
+        worker_data["gt_version"] += 1
+        with open(update_path(worker_data["update_dir"], worker_data["gt_version"]), "rb") as f:
+            worker_data["gt"].tracks.update(pickle.load(f))
+
+def worker_counters() -> dict:
+    '''
+    The counters of the statistics in the worker process, which can be added up across the processes
+    '''
+    counters = {"frame_cache": frame_cache.counters(), "prefetch": prefetch_stats.counters()}
+    if worker_data["traj_cache"] is not None:
+        counters["traj_cache"] = worker_data["traj_cache"].counters()
+    return counters
+
+def counters_delta(before: dict, after: dict) -> dict:
+    '''
+    The change of the counters from before to after, see worker_counters
+    '''
+    return {name: {key: after[name][key] - before[name][key] for key in after[name]} for name in after}
+
+def add_worker_counters(counters: dict, traj_cache: object = None) -> None:
+    '''
+    Add the counters returned by a job to the statistics of the main process, so the printed statistics
+    include the tracking done in the workers
+    Input:
+        counters: the counters returned by tracker_eval_job or tracker_race_job
+        traj_cache: the TrajectoryCache of the main process the pool was created with
+    '''
+    frame_cache.add_counters(counters["frame_cache"])
+    prefetch_stats.add_counters(counters["prefetch"])
+    if traj_cache is not None:
+        traj_cache.add_counters(counters["traj_cache"])
+
+def tracker_eval_job(gt_version: int, start: int, end: int, track_type: int, obj_id: int, **kargs) -> tuple:
+    '''
+    Run tracker_eval in the worker process with the shared gt and frame list
+    Input:
+        gt_version: the version of the gt the job runs on, see WorkerPool.sync
+        start & end: the frame sequence id for tracking
+        track_type: the tracker used for tracking
+        obj_id: the id of the object to be tracked
+        kargs: the other options passed to tracker_eval
+    Output:
+        result: the output of tracker_eval
+        counters: the change of the counters of the worker during the job, see add_worker_counters
+    '''
+    sync_worker(gt_version)
+    traj_cache = worker_data["traj_cache"]
+    before = worker_counters()
+    result = tracker_eval(worker_data["gt"], worker_data["frame_list"], start, end, track_type, obj_id, traj_cache = traj_cache, **kargs)
+    if traj_cache is not None:
+        traj_cache.flush()
+    return result, counters_delta(before, worker_counters())
+
+def tracker_race_job(gt_version: int, start: int, end: int, track_type: int, obj_id: int, viou_thresh: float, **kargs) -> tuple:
+    '''
+    Run tracker_race_eval in the worker process with the shared gt and frame list. The trackers of an interval
+    run at the same time in different workers and don't see the viou of each other, so the tracker is only
+    aborted once it can't reach viou_thresh, not when it can't beat the best tracker like the serial racing.
+    Input:
+        gt_version: the version of the gt the job runs on, see WorkerPool.sync
+        start & end: the frame sequence id for tracking
+        track_type: the tracker used for tracking
+        obj_id: the id of the object to be tracked
+        viou_thresh: the minimal viou to accept the tracker
+        kargs: the other options passed to tracker_race_eval
+    Output:
+        result: the output of tracker_race_eval
+        counters: the change of the counters of the worker during the job, see add_worker_counters
+    '''
+    sync_worker(gt_version)
+    traj_cache = worker_data["traj_cache"]
+    before = worker_counters()
+    result = tracker_race_eval(worker_data["gt"], worker_data["frame_list"], start, end, track_type, obj_id, viou_thresh, traj_cache = traj_cache, **kargs)
+    if traj_cache is not None:
+        traj_cache.flush()
+    return result, counters_delta(before, worker_counters())
+
+def track_state(columns: object) -> tuple:
+    '''
+    The copy of the columns of a track the tracking depends on, to find the tracks changed since they were sent
+    '''
+    return (columns.frames.copy(), columns.occluded.copy(), columns.keyframe.copy(), columns.coords.copy())
+
+class WorkerPool:
+    def __init__(self, gt: object, frame_list: list, num_workers: int, cache_mb: int = 1024, siamrpn_warmup: bool = None,
+                 prefetch_frames: int = 8, traj_cache: object = None) -> None:
+        '''
+        The process pool to evaluate the trackers in parallel. It is created once and kept for all the labeling
+        rounds, so the workers load the frames and the SiamRPN model once. The gt is sent when the workers start,
+        the tracks changed after that (e.g. the labeled keyframes) are sent by sync.
+        Input:
+            gt: the gt object generated from the xml file
+            frame_list: the frame sequences for tracking
+            num_workers: the number of worker processes
+            cache_mb: the memory budget of the frame cache in each worker
+            siamrpn_warmup: if not None, each worker loads the SiamRPN model when it starts, see init_worker
+            prefetch_frames: the number of frames decoded ahead of the tracking in each worker
+            traj_cache: the TrajectoryCache shared by the jobs, sent once to each worker. Flush it in the main process
+                        while no job is running to merge the hashes of the workers
+        '''
+        self.gt = gt
+        self.traj_cache = traj_cache
+        # The version of the gt sent to the workers, increased by each sync with changed tracks
+        self.version = 0
+        self.sent = {t_id: track_state(columns) for t_id, columns in gt.tracks.items()}
+        self.update_dir = tempfile.mkdtemp(prefix = "gt_updates_")
+
+        # Spawn the workers instead of forking, the torch/CUDA state of the parent can't be shared with a fork
+        ctx = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers = num_workers, mp_context = ctx, initializer = init_worker,
+                                            initargs = (gt, frame_list, cache_mb, siamrpn_warmup, prefetch_frames, traj_cache, self.update_dir))
+
+    def sync(self) -> int:
+        '''
+        Send the tracks changed since the last sync to the workers. The changed tracks are written into a file of
+        the new version of the gt, each worker loads the versions it misses before its next job.
+        Output:
+            num: the number of the changed tracks
+        '''
+        changed = {}
+        for t_id, columns in self.gt.tracks.items():
+            state = track_state(columns)
+            sent = self.sent.get(t_id)
+            if sent is None or any(a.shape != b.shape or not np.array_equal(a, b) for a, b in zip(state, sent)):
+                changed[t_id] = columns
+                self.sent[t_id] = state
+
+        if len(changed) > 0:
+            self.version += 1
+            with open(update_path(self.update_dir, self.version), "wb") as f:
+                pickle.dump(changed, f, protocol = pickle.HIGHEST_PROTOCOL)
+        return len(changed)
+
+    def submit(self, job: object, *args, **kargs) -> object:
+        '''
+        Submit tracker_eval_job or tracker_race_job on the current version of the gt
+        Output:
+            future: the future of the job
+        '''
+        return self.executor.submit(job, self.version, *args, **kargs)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+        shutil.rmtree(self.update_dir, ignore_errors = True)
@@ -0,0 +1,154 @@
+import os
+import cv2
+import shutil
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from frame_provider import frame_name, FramePrefetcher
+
+class VideoEncoder:
+    def __init__(self, vid_path: str, frame_size: tuple, fps: float = 30) -> None:
+        '''
+        Encode the frames into a video as they are written. The frames are piped into ffmpeg with the same
+        encoding options as frame_to_vid, cv2.VideoWriter is used if ffmpeg is not available.
+        Input:
+            vid_path: the path to the generated video
+            frame_size: (width, height) of the frames
+            fps: the fps for the video
+        '''
+        self.vid_path = vid_path
+        self.process = None
+        self.writer = None
+        width, height = frame_size
+
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is not None:
+            cmd = [ffmpeg, "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-r", str(fps), "-crf", "25", "-c:v", "libx264",
+                   "-pix_fmt", "yuv420p", "-movflags", "+faststart", vid_path]
+            self.process = subprocess.Popen(cmd, stdin = subprocess.PIPE)
+        else:
+            self.writer = cv2.VideoWriter(vid_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+            assert self.writer.isOpened(), f"Can't open the video writer for {vid_path}"
+
+    def write(self, frame: object) -> None:
+        if self.process is not None:
+            self.process.stdin.write(frame.tobytes())
+        else:
+            self.writer.write(frame)
+
+    def close(self) -> None:
+        '''
+        Finish the video, wait for the encoder to write the file
+        '''
+        if self.process is not None:
+            self.process.stdin.close()
+            ret = self.process.wait()
+            assert ret == 0, f"ffmpeg failed to encode {self.vid_path}"
+        else:
+            self.writer.release()
+
+    def abort(self) -> None:
+        '''
+        Stop the encoder after a failure without checking the result, the video is incomplete
+        '''
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                # ffmpeg already exited, e.g. the broken pipe which caused the failure
+                pass
+            self.process.kill()
+            self.process.wait()
+        else:
+            self.writer.release()
+
+def draw_frame(frame: object, idx: int, bboxes: dict, add_gt: bool = False, gt: list = None, keyframe: list = None) -> object:
+    '''
+    Draw the bboxes of the frame on a copy of the frame
+    Input:
+        frame: the decoded frame, it is not modified
+        idx: the index of the frame in the sequence
+        bboxes, add_gt, gt, keyframe: see render_result
+    Output:
+        frame: the drawn frame
+    '''
+    # The decoded frame is shared, draw on a copy
+    frame = frame.copy()
+
+    if idx in bboxes:
+        bbox = bboxes[idx]
+        p1 = (int(bbox[0]), int(bbox[1]))
+        p2 = (int(bbox[2]), int(bbox[3]))
+        cv2.rectangle(frame, p1, p2, (255,0,0), 2, 1)
+
+    if add_gt:
+        bbox = gt[idx]
+        if len(bbox) == 4:
+            p1 = (int(bbox[0]), int(bbox[1]))
+            p2 = (int(bbox[2]), int(bbox[3]))
+            cv2.rectangle(frame, p1, p2, (0,0,255), 2, 1)
+
+    if keyframe is not None and idx in keyframe:
+        cv2.putText(frame, "Manually labeled", (100,80), cv2.FONT_HERSHEY_SIMPLEX, 0.75,(0,0,255),2)
+
+    return frame
+
+def render_result(frame_list: list, bboxes: dict, save_path: str, add_gt: bool = False, gt: list = None, keyframe: list = None,
+                  is_vid: bool = True, save_frames: bool = False, vid_name: str = "test", fps: float = 30,
+                  num_workers: int = 4, queue_size: int = 16) -> None:
+    '''
+    Draw the bboxes into the frames and encode them into a video in one pass. The frames are decoded in order on a
+    background thread, drawn by the worker threads and written to the encoder in order. At most queue_size frames
+    are in flight, so the memory doesn't grow with the length of the sequence.
+    Input:
+        frame_list: the list of path to all the original frame image, or a lazy frame sequence
+        bboxes: the dictionary (or Trajectory) to store all bboxes
+        save_path: the path to save the result
+        add_gt: add the ground truth into the frame or not. If yes, gt need to be specified
+        gt: the gt bbox list, or the Trajectory from GTdata.get_bboxes
+        keyframe: the list of frame which belongs to the keyframe
+        is_vid: encode the drawn frames into <save_path>/<vid_name>.mp4
+        save_frames: also write each drawn frame as an image into save_path
+        vid_name: the name of the generated video
+        fps: the fps for the video
+        num_workers: the number of threads drawing the frames
+        queue_size: the maximal number of frames decoded or drawn but not written yet
+    '''
+    if not os.path.exists(save_path):
+        os.makedirs(save_path, exist_ok = True)
+
+    def draw(frame: object, idx: int) -> object:
+        frame = draw_frame(frame, idx, bboxes, add_gt, gt, keyframe)
+        if save_frames:
+            cv2.imwrite(os.path.join(save_path, frame_name(frame_list, idx)), frame)
+        return frame
+
+    reader = FramePrefetcher(frame_list, list(range(len(frame_list))), depth = queue_size)
+    encoder = None
+    pending = deque()
+    is_finished = False
+    try:
+        with ThreadPoolExecutor(max_workers = num_workers) as executor:
+            for idx in range(len(frame_list)):
+                frame = reader.read()
+                assert frame is not None, f"Can't read the frame {frame_name(frame_list, idx)}"
+                pending.append(executor.submit(draw, frame, idx))
+
+                # Write the oldest frames once the queue is full
+                while len(pending) >= queue_size or (idx == len(frame_list) - 1 and len(pending) > 0):
+                    frame = pending.popleft().result()
+                    if is_vid:
+                        if encoder is None:
+                            encoder = VideoEncoder(os.path.join(save_path, vid_name + ".mp4"), (frame.shape[1], frame.shape[0]), fps)
+                        encoder.write(frame)
+        is_finished = True
+    finally:
+        reader.close()
+        if encoder is not None:
+            # Only check the encoder of a finished video, a failure must not hide the original error
+            if is_finished:
+                encoder.close()
+            else:
+                encoder.abort()
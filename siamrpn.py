@@ -5,7 +5,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 import cv2
-from collections import namedtuple
+import threading
+from collections import namedtuple, OrderedDict
 from got10k.trackers import Tracker
 
 
@@ -67,24 +68,132 @@ class SiamRPN(nn.Module):
 
         return out_reg, out_cls
 
+    def inference_batch(self, x, kernel_reg, kernel_cls):
+        # x holds the search images of n independent tracks, and the
+        # kernels of the tracks are stacked along the first dim, each
+        # track is correlated with its own kernels by a grouped conv
+        n = x.size(0)
+        x = self.feature(x)
+        x_reg = self.conv_reg_x(x)
+        x_cls = self.conv_cls_x(x)
+
+        x_reg = x_reg.view(1, -1, x_reg.size(2), x_reg.size(3))
+        x_cls = x_cls.view(1, -1, x_cls.size(2), x_cls.size(3))
+        out_reg = F.conv2d(x_reg, kernel_reg, groups=n)
+        out_cls = F.conv2d(x_cls, kernel_cls, groups=n)
+
+        out_reg = self.adjust_reg(out_reg.view(
+            n, -1, out_reg.size(2), out_reg.size(3)))
+        out_cls = out_cls.view(n, -1, out_cls.size(2), out_cls.size(3))
+
+        return out_reg, out_cls
+
+
+# the networks loaded in this process, shared by all tracker sessions
+net_registry = {}
+net_warmed = set()
+registry_lock = threading.Lock()
+
+
+def default_device():
+    # setup GPU device if available
+    return torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+
+def load_net(net_path=None, device=None, warmup=False):
+    # load the weights once per process and device, later calls
+    # return the same network
+    if device is None:
+        device = default_device()
+    key = (net_path, str(device))
+
+    with registry_lock:
+        net = net_registry.get(key)
+        if net is None:
+            net = SiamRPN()
+            if net_path is not None:
+                net.load_state_dict(torch.load(
+                    net_path, map_location=lambda storage, loc: storage))
+            net = net.to(device)
+            net.eval()
+            net_registry[key] = net
+
+        # run a dummy pass so that the first tracking call doesn't pay
+        # for the lazy initialization of the backend
+        if warmup and key not in net_warmed:
+            with torch.set_grad_enabled(False):
+                z = torch.zeros(1, 3, 127, 127, device=device)
+                x = torch.zeros(1, 3, 271, 271, device=device)
+                net.inference(x, *net.learn(z))
+            net_warmed.add(key)
+
+    return net
+
+
+class KernelCache(object):
+
+    def __init__(self, max_entries=128):
+        # bounded LRU cache of the exemplar kernels, keyed by
+        # (frame id, rounded bbox, model), so that re-initialising a
+        # track from the same labeled box skips the feature extractor
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def resize(self, max_entries):
+        with self.lock:
+            self.max_entries = max_entries
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# the exemplar kernels shared by all tracker sessions in this process
+kernel_cache = KernelCache()
+
 
 class TrackerSiamRPN(Tracker):
 
-    def __init__(self, net_path=None, **kargs):
+    # anchors and hanning windows shared by all sessions, keyed by
+    # the response size and the anchor settings
+    table_cache = {}
+
+    def __init__(self, net_path=None, warmup=False, **kargs):
+        # a lightweight per-track session, the network is loaded once
+        # per process and shared through the registry
         super(TrackerSiamRPN, self).__init__(
             name='SiamRPN', is_deterministic=True)
         self.parse_args(**kargs)
 
         # setup GPU device if available
-        self.cuda = torch.cuda.is_available()
-        self.device = torch.device('cuda:0' if self.cuda else 'cpu')
+        self.device = default_device()
+        self.cuda = self.device.type == 'cuda'
 
         # setup model
-        self.net = SiamRPN()
-        if net_path is not None:
-            self.net.load_state_dict(torch.load(
-                net_path, map_location=lambda storage, loc: storage))
-        self.net = self.net.to(self.device)
+        self.net_path = net_path
+        self.net = load_net(net_path, self.device, warmup)
+
+        # the reused patch arrays and input tensors, keyed by the
+        # patch size, so the crops don't allocate per frame
+        self.buffers = {}
 
     def parse_args(self, **kargs):
         self.cfg = {
@@ -102,8 +211,15 @@ class TrackerSiamRPN(Tracker):
             self.cfg.update({key: val})
         self.cfg = namedtuple('GenericDict', self.cfg.keys())(**self.cfg)
 
-    def init(self, image, box):
+    def init(self, image, box, frame_key=None):
+        # frame_key identifies the image, e.g. its path, the exemplar
+        # kernels are cached by it if given
         image = np.asarray(image)
+        cache_key = None
+        if frame_key is not None:
+            cache_key = (frame_key, tuple(int(round(x)) for x in box),
+                         self.net_path, str(self.device),
+                         self.cfg.exemplar_sz, self.cfg.context)
 
         # convert box to 0-indexed and center based [y, x, h, w]
         box = np.array([
@@ -116,18 +232,10 @@ class TrackerSiamRPN(Tracker):
         if np.prod(self.target_sz) / np.prod(image.shape[:2]) < 0.004:
             self.cfg = self.cfg._replace(instance_sz=287)
 
-        # generate anchors
+        # generate anchors and hanning window
         self.response_sz = (self.cfg.instance_sz - \
             self.cfg.exemplar_sz) // self.cfg.total_stride + 1
-        self.anchors = self._create_anchors(self.response_sz)
-
-        # create hanning window
-        self.hann_window = np.outer(
-            np.hanning(self.response_sz),
-            np.hanning(self.response_sz))
-        self.hann_window = np.tile(
-            self.hann_window.flatten(),
-            len(self.cfg.ratios) * len(self.cfg.scales))
+        self.anchors, self.hann_window = self._get_tables(self.response_sz)
 
         # exemplar and search sizes
         context = self.cfg.context * np.sum(self.target_sz)
@@ -135,6 +243,12 @@ class TrackerSiamRPN(Tracker):
         self.x_sz = self.z_sz * \
             self.cfg.instance_sz / self.cfg.exemplar_sz
 
+        # the kernels of the same frame and box were learned before
+        cached = kernel_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self.kernel_reg, self.kernel_cls, self.avg_color = cached
+            return True
+
         # exemplar image
         self.avg_color = np.mean(image, axis=(0, 1))
         exemplar_image = self._crop_and_resize(
@@ -142,30 +256,75 @@ class TrackerSiamRPN(Tracker):
             self.cfg.exemplar_sz, self.avg_color)
 
         # classification and regression kernels
-        exemplar_image = torch.from_numpy(exemplar_image).to(
-            self.device).permute([2, 0, 1]).unsqueeze(0).float()
+        exemplar_image = self._input_tensor(exemplar_image)
         with torch.set_grad_enabled(False):
             self.net.eval()
             self.kernel_reg, self.kernel_cls = self.net.learn(exemplar_image)
 
+        if cache_key is not None:
+            kernel_cache.put(cache_key, (
+                self.kernel_reg, self.kernel_cls, self.avg_color))
+
         return True
 
     def update(self, image):
         image = np.asarray(image)
         
         # search image
-        instance_image = self._crop_and_resize(
-            image, self.center, self.x_sz,
-            self.cfg.instance_sz, self.avg_color)
+        instance_image = self._search_input(image)
 
         # classification and regression outputs
-        instance_image = torch.from_numpy(instance_image).to(
-            self.device).permute(2, 0, 1).unsqueeze(0).float()
         with torch.set_grad_enabled(False):
             self.net.eval()
             out_reg, out_cls = self.net.inference(
                 instance_image, self.kernel_reg, self.kernel_cls)
-        
+
+        return self._locate(image, out_reg, out_cls)
+
+    @staticmethod
+    def update_batch(trackers, images):
+        # advance n independent tracks (e.g. forward and backward passes,
+        # intervals or objects) with one forward pass per network and
+        # search size, returns the (ok, box) of each track in order
+        results = [None] * len(trackers)
+
+        groups = {}
+        for i, tracker in enumerate(trackers):
+            key = (id(tracker.net), tracker.cfg.instance_sz)
+            groups.setdefault(key, []).append(i)
+
+        for ids in groups.values():
+            net = trackers[ids[0]].net
+            batch_images = [np.asarray(images[i]) for i in ids]
+
+            # stacked search crops and kernels of the group
+            instance_images = torch.cat([
+                trackers[i]._search_input(image)
+                for i, image in zip(ids, batch_images)])
+            kernel_reg = torch.cat([trackers[i].kernel_reg for i in ids])
+            kernel_cls = torch.cat([trackers[i].kernel_cls for i in ids])
+
+            with torch.set_grad_enabled(False):
+                net.eval()
+                out_reg, out_cls = net.inference_batch(
+                    instance_images, kernel_reg, kernel_cls)
+
+            for j, i in enumerate(ids):
+                results[i] = trackers[i]._locate(
+                    batch_images[j], out_reg[j:j + 1], out_cls[j:j + 1])
+
+        return results
+
+    def _search_input(self, image):
+        # search image of the current state as a 1x3xHxW tensor
+        instance_image = self._crop_and_resize(
+            image, self.center, self.x_sz,
+            self.cfg.instance_sz, self.avg_color)
+        return self._input_tensor(instance_image)
+
+    def _locate(self, image, out_reg, out_cls):
+        # update the state from the network outputs of the search image
+
         # offsets
         offsets = out_reg.permute(
             1, 2, 3, 0).contiguous().view(4, -1).cpu().numpy()
@@ -211,6 +370,29 @@ class TrackerSiamRPN(Tracker):
 
         return True, box
 
+    def _get_tables(self, response_sz):
+        key = (response_sz, self.cfg.total_stride,
+               tuple(self.cfg.ratios), tuple(self.cfg.scales))
+        tables = self.table_cache.get(key)
+        if tables is None:
+            anchors = self._create_anchors(response_sz)
+
+            # create hanning window
+            hann_window = np.outer(
+                np.hanning(response_sz),
+                np.hanning(response_sz))
+            hann_window = np.tile(
+                hann_window.flatten(),
+                len(self.cfg.ratios) * len(self.cfg.scales))
+
+            # the tables are shared, keep them read-only
+            anchors.flags.writeable = False
+            hann_window.flags.writeable = False
+            tables = (anchors, hann_window)
+            self.table_cache[key] = tables
+
+        return tables
+
     def _create_anchors(self, response_sz):
         anchor_num = len(self.cfg.ratios) * len(self.cfg.scales)
         anchors = np.zeros((anchor_num, 4), dtype=np.float32)
@@ -270,20 +452,40 @@ class TrackerSiamRPN(Tracker):
             np.round(center - (size - 1) / 2) + size))
         corners = np.round(corners).astype(int)
 
-        # pad image if necessary
-        pads = np.concatenate((
-            -corners[:2], corners[2:] - image.shape[:2]))
-        npad = max(0, int(pads.max()))
-        if npad > 0:
-            image = cv2.copyMakeBorder(
-                image, npad, npad, npad, npad,
-                cv2.BORDER_CONSTANT, value=pad_color)
-
-        # crop image patch
-        corners = (corners + npad).astype(int)
-        patch = image[corners[0]:corners[2], corners[1]:corners[3]]
-
-        # resize to out_size
-        patch = cv2.resize(patch, (out_size, out_size))
+        # crop and resize in one affine warp from the output patch to
+        # the crop region, with the same sampling as cv2.resize:
+        # src = (dst + 0.5) * scale - 0.5 + corner. the region out of
+        # the image is filled with pad_color, so the frame is never
+        # padded or copied
+        scale = size / out_size
+        matrix = np.array([
+            [scale, 0, corners[1] + 0.5 * scale - 0.5],
+            [0, scale, corners[0] + 0.5 * scale - 0.5]])
+        patch = self._patch_buffer(out_size, image)
+        cv2.warpAffine(
+            image, matrix, (out_size, out_size), dst=patch,
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=tuple(float(x) for x in pad_color))
 
         return patch
+
+    def _patch_buffer(self, out_size, image):
+        # the reused output array of the crops of out_size
+        shape = (out_size, out_size) + image.shape[2:]
+        buffer = self.buffers.get(out_size)
+        if buffer is None or buffer[0].shape != shape or \
+                buffer[0].dtype != image.dtype:
+            patch = np.empty(shape, dtype=image.dtype)
+            tensor = torch.empty(
+                (1, patch.shape[2], out_size, out_size),
+                dtype=torch.float32, device=self.device)
+            buffer = self.buffers[out_size] = (patch, tensor)
+        return buffer[0]
+
+    def _input_tensor(self, patch):
+        # copy the HxWx3 patch into the reused 1x3xHxW float tensor,
+        # the tensor is overwritten by the next crop of the same size
+        tensor = self.buffers[patch.shape[0]][1]
+        tensor[0].copy_(torch.from_numpy(patch).permute(2, 0, 1))
+        return tensor
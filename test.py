@@ -1,4 +1,5 @@
 from utils import *
+from trajectory import interpolate_keyframes
 import json
 
 if __name__ == "__main__":
@@ -7,13 +8,17 @@ if __name__ == "__main__":
     with open(json_path, 'r') as f:
         cfg = json.load(f)
 
-    gt = GTdata(cfg["xml_path"])
+    # Load the gt from its binary sidecar instead of parsing the xml file in every run
+    gt = GTdata.load(cfg["xml_path"]) if cfg.get("gt_sidecar", False) else GTdata(cfg["xml_path"])
 
     interval = cfg["intervals"]
 
     assert len(interval) > 0, "No valid interval."
 
-    frame_list = frame_list_gen(cfg["img_path"], start = interval[0][0], end = interval[-1][-1])
+    if cfg.get("video_path"):
+        frame_list = video_frame_list(cfg["video_path"], start = interval[0][0], end = interval[-1][-1])
+    else:
+        frame_list = frame_list_gen(cfg["img_path"], start = interval[0][0], end = interval[-1][-1])
 
     final_interval = []
 
@@ -45,14 +50,7 @@ if __name__ == "__main__":
             bbox_0 = gt.get_bbox(cfg["obj_id"], cur_interval[0])
             bbox_1 = gt.get_bbox(cfg["obj_id"], cur_interval[1])
 
-            for idx in range(cur_interval[0], cur_interval[1] + 1):
-                weight = (idx - cur_interval[0])/length
-                bbox_interpolate = (bbox_0[0]*(1 - weight) + bbox_1[0]*weight,
-                        bbox_0[1]*(1 - weight) + bbox_1[1]*weight,
-                        (bbox_0[2]*(1 - weight) + bbox_1[2]*weight),
-                        (bbox_0[3]*(1 - weight) + bbox_1[3]*weight))
-
-                i_bbox_traj[idx] = bbox_interpolate
+            i_bbox_traj.update(to_bbox_traj(cur_interval[0], interpolate_keyframes(bbox_0, bbox_1, length)))
             print("The result is manually labeled.")
             continue
 
@@ -69,13 +67,8 @@ if __name__ == "__main__":
                 if viou_max == 0:
                     final_interval.append(cur_interval)
 
-                length = cur_interval[1] - cur_interval[0] + 1
-
                 # Calculate the interpolated trajectory between forward and backward tracking
-                i_bboxes = for_back_interpolation(ftrack, btrack)
-
-                for idx in range(0, length):
-                    i_bbox_traj[idx + cur_interval[0]] = i_bboxes[idx]
+                i_bbox_traj.update(to_bbox_traj(cur_interval[0], blend_tracks(ftrack, btrack)))
 
                 viou_max = viou
             
@@ -0,0 +1,32 @@
+import os
+from cvat_gt_converter import GTdata
+from test_gt_keyframe_iou import write_xml
+
+def crash_with_edits(xml_path, edits):
+    # Journal the edits and stop without compacting them, like a crash
+    gt = GTdata(xml_path)
+    gt.enable_journal(compact_interval = 0)
+    gt.update_boxes(edits)
+    gt.journal.close()
+    return gt.journal.journal_path
+
+def test_load_replays_journal(tmp_path):
+    xml_path = write_xml(tmp_path / "annotations.xml")
+    journal_path = crash_with_edits(xml_path, {(0, 12): (1.0, 2.0, 30.0, 40.0)})
+
+    gt = GTdata(xml_path)
+    assert gt.get_bbox(0, 12) == (1.0, 2.0, 30.0, 40.0)
+    assert os.path.exists(journal_path)
+
+    # The flush writes the replayed edits into the xml file and removes the journal
+    gt.flush()
+    assert not os.path.exists(journal_path)
+    assert GTdata(xml_path).get_bbox(0, 12) == (1.0, 2.0, 30.0, 40.0)
+
+def test_load_reports_edits_of_tracks_not_loaded(tmp_path, capsys):
+    xml_path = write_xml(tmp_path / "annotations.xml")
+    crash_with_edits(xml_path, {(0, 12): (1.0, 2.0, 30.0, 40.0)})
+
+    gt = GTdata(xml_path, obj_ids = [1])
+    assert "[0]" in capsys.readouterr().out
+    assert len(gt.pending) == 1
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from cvat_gt_converter import GTdata
+from iou import as_boxes
+
+# The keyframes of the track, the other frames have a box which is not a keyframe
+KEYFRAMES = {10: (100.0, 50.0, 180.0, 120.0), 15: (130.0, 55.0, 210.0, 125.0)}
+
+def write_xml(path, frame_num = 20):
+    boxes = []
+    for frame_id in range(frame_num):
+        xtl, ytl, xbr, ybr = KEYFRAMES.get(frame_id, (10.0, 10.0, 20.0, 20.0))
+        is_key = int(frame_id in KEYFRAMES or frame_id in (0, frame_num - 1))
+        boxes.append(f'    <box frame="{frame_id}" outside="0" occluded="0" keyframe="{is_key}" '
+                     f'xtl="{xtl}" ytl="{ytl}" xbr="{xbr}" ybr="{ybr}" z_order="0">\n    </box>')
+    path.write_text("\n".join([
+        '<?xml version="1.0" encoding="utf-8"?>', '<annotations>', '  <version>1.1</version>',
+        '  <meta>', '    <task>', '      <id>1</id>', '      <name>clip</name>', f'      <size>{frame_num}</size>',
+        '      <labels>', '        <label>', '          <name>car</name>', '        </label>', '      </labels>',
+        '      <original_size>', '        <width>640</width>', '        <height>480</height>', '      </original_size>',
+        '    </task>', '  </meta>',
+        '  <track id="0" label="car" source="manual">'] + boxes + ['  </track>', '</annotations>']))
+    return str(path)
+
+def test_as_boxes_trajectory_rows(tmp_path):
+    # The interior of the interval [5, 19] starts at frame 6, only the frames 10 and 15 are keyframes
+    gt = GTdata(write_xml(tmp_path / "annotations.xml"))
+    boxes, valid = as_boxes(gt.get_bboxes(0, 6, 19))
+
+    assert boxes.shape == (13, 4)
+    assert np.flatnonzero(valid).tolist() == [4, 9]
+    assert np.allclose(boxes[4], KEYFRAMES[10])
+    assert np.allclose(boxes[9], KEYFRAMES[15])
+
+def test_gt_keyframe_iou_interior_keyframes(tmp_path):
+    pytest.importorskip("cv2")
+    pytest.importorskip("torch")
+    from utils import gt_keyframe_iou
+    from trajectory import Trajectory
+
+    gt = GTdata(write_xml(tmp_path / "annotations.xml"))
+    start, end = 5, 19
+
+    # Both directions agree with the keyframes, the other frames are far away
+    ftrack = [KEYFRAMES.get(x, (300.0, 300.0, 310.0, 310.0)) for x in range(start, end + 1)]
+    btrack = ftrack[::-1]
+
+    gt_iou, gt_num = gt_keyframe_iou(gt, 0, start, end, Trajectory(ftrack), Trajectory(btrack))
+    assert gt_num == 2
+    assert gt_iou == pytest.approx(1.0)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from trajectory import Trajectory
+
+def test_index_by_frame_id():
+    traj = Trajectory([(1.0, 2.0, 3.0, 4.0), (), (5.0, 6.0, 7.0, 8.0)], start = 10)
+
+    assert traj[10] == (1.0, 2.0, 3.0, 4.0)
+    assert traj[11] == ()
+    assert traj.at(-1) == traj[12] == (5.0, 6.0, 7.0, 8.0)
+    assert traj.at(0) == traj[10]
+
+    # A negative int is a frame id like any other int, not a position
+    with pytest.raises(IndexError):
+        traj[-1]
+    with pytest.raises(IndexError):
+        traj[0]
+
+def test_keep_float64():
+    bbox = (100.123456789, 50.987654321, 180.5, 120.25)
+    traj = Trajectory([bbox])
+
+    assert np.asarray(traj).dtype == np.float64
+    assert traj[0] == bbox
@@ -1,23 +1,27 @@
 import cv2
 import sys
 import time
-from tqdm import tqdm
-from siamrpn import TrackerSiamRPN
+from siamrpn import TrackerSiamRPN, load_net, kernel_cache
+from frame_provider import read_frame, read_scaled_frame, frame_key, FramePrefetcher
+from trajectory import Trajectory
 
-def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str = 0, is_inverse: bool = False) -> list:
+# The pretrained weights of the SiamRPN tracker
+SIAMRPN_NET_PATH = 'pretrained/siamrpn/model.pth'
+
+# The scales tried by the automatic downscaling, few fixed values so the resized frames are shared by the intervals
+AUTO_SCALES = (1.0, 0.75, 0.5, 0.375, 0.25)
+# The automatic downscaling keeps the shorter side of the target at least this number of pixels
+AUTO_MIN_TARGET = 48
+
+def tracker_name(tracker_type: int or str = 0) -> str:
     '''
-    The function to use opencv supported trackers for tracking
+    Get the name of the tracker by its name or index
     Input:
-        tracker_type: the type of trackers to be used. The input shold be the name or the index of the following list
-                      ['BOOSTING', 'MIL','KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT'] 
-        frame_list: a list of path to the sequence of frames to track
-        is_inverse: whether tracking the frames inversely or not.
-        init_bbox: the initial bbox in the first frame. [xtl, ytl, xbr, ybr]
+        tracker_type: the name or the index of the following list
+                      ['BOOSTING', 'MIL','KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT', 'SIAMRPN'] 
     Output:
-        bbox_list: the tracked bbox in each frame. [[xtl, ytl, xbr, ybr],...,[xtl, ytl, xbr, ybr]]
+        tracker_type: the upper case name of the tracker
     '''
-
-    # Select the tracker
     tracker_types = ['BOOSTING', 'MIL','KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT', 'SIAMRPN']
     if isinstance(tracker_type, int) and tracker_type >= 0 and tracker_type <= 8:
         tracker_type = tracker_types[tracker_type]
@@ -25,6 +29,56 @@ def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str =
         tracker_type = tracker_type.upper()
     else:
         assert False, "The tracker type is not supported"
+    return tracker_type
+
+def track_scale(scale: float or str, init_bbox: list, tracker_type: int or str = 0) -> float:
+    '''
+    Decide the scale of the frames the tracker runs on
+    Input:
+        scale: the ratio of the tracked frames to the original frames in (0, 1], or "auto" to choose the smallest
+               scale in AUTO_SCALES which keeps the target large enough to be tracked
+        init_bbox: the initial bbox in the original frame. [xtl, ytl, xbr, ybr]
+        tracker_type: the type of trackers to be used, see create_tracker
+    Output:
+        scale: the scale of the tracked frames, always 1.0 for SiamRPN which crops its own fixed size search region
+    '''
+    if tracker_name(tracker_type) == 'SIAMRPN':
+        return 1.0
+    if scale == "auto":
+        side = min(init_bbox[2] - init_bbox[0], init_bbox[3] - init_bbox[1])
+        scales = [x for x in AUTO_SCALES if side * x >= AUTO_MIN_TARGET]
+        return min(scales) if len(scales) > 0 else 1.0
+    scale = float(scale)
+    assert 0.0 < scale <= 1.0, "The tracking scale must be in (0, 1]."
+    return scale
+
+def set_kernel_cache_size(max_entries: int) -> None:
+    '''
+    Set the number of exemplar kernels kept by the SiamRPN kernel cache
+    Input:
+        max_entries: the maximal number of cached kernels, each takes about 1 MB
+    '''
+    kernel_cache.resize(max_entries)
+
+def preload_siamrpn(warmup: bool = True) -> None:
+    '''
+    Load the SiamRPN model into the process-wide registry, so the cold-start cost is paid once per process
+    Input:
+        warmup: whether to run a dummy pass through the network after loading
+    '''
+    load_net(SIAMRPN_NET_PATH, warmup = warmup)
+
+def create_tracker(tracker_type: int or str = 0) -> object:
+    '''
+    Create the tracker by its name or index
+    Input:
+        tracker_type: the type of trackers to be used. The input shold be the name or the index of the following list
+                      ['BOOSTING', 'MIL','KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT', 'SIAMRPN'] 
+    Output:
+        tracker: the created tracker
+    '''
+    # Select the tracker
+    tracker_type = tracker_name(tracker_type)
 
     # Setup the trackers
     if tracker_type == 'BOOSTING':
@@ -44,8 +98,24 @@ def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str =
     if tracker_type == "CSRT":
         tracker = cv2.TrackerCSRT_create()
     if tracker_type == 'SIAMRPN':
-        net_path = 'pretrained/siamrpn/model.pth'
-        tracker = TrackerSiamRPN(net_path=net_path)
+        # The session shares the network loaded once in the process
+        tracker = TrackerSiamRPN(net_path=SIAMRPN_NET_PATH)
+
+    return tracker
+
+def tracker_steps(frame_list: list, init_bbox: list, tracker_type: int or str = 0, is_inverse: bool = False, scale: float = 1.0) -> object:
+    '''
+    Track the frames one by one, the generator stops when the tracking fails
+    Input:
+        tracker_type: the type of trackers to be used, see create_tracker
+        frame_list: a list of path to the sequence of frames to track, or a lazy frame sequence
+        is_inverse: whether tracking the frames inversely or not.
+        init_bbox: the initial bbox in the first frame. [xtl, ytl, xbr, ybr]
+        scale: track on the frames resized by the scale, see track_scale. The bboxes are in the original frame.
+    Output:
+        bbox: yield the tracked bbox in each frame, starting from the init_bbox. [xtl, ytl, xbr, ybr]
+    '''
+    tracker = create_tracker(tracker_type)
 
     # Generate the loop list
     frame_length = len(frame_list)
@@ -54,8 +124,8 @@ def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str =
     else:
         loop = [x for x in range(0, frame_length)]
 
-    # Generate the initial bbox and round the number
-    xtl, ytl, xbr, ybr = init_bbox
+    # Generate the initial bbox in the tracked frame and round the number
+    xtl, ytl, xbr, ybr = [x * scale for x in init_bbox]
 
     width = int(xbr - xtl + 0.5)
     height = int(ybr - ytl + 0.5)
@@ -63,48 +133,139 @@ def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str =
     ytl = int(ytl + 0.5)
     bbox = (xtl, ytl, width, height)
 
-    bbox_list = [(xtl, ytl, int(xbr), int(ybr))]
-    # Initial the tracker with the first frame
-    init_frame = cv2.imread(frame_list[loop[0]])
-    f_height, f_width, _ = init_frame.shape
-    ok = tracker.init(init_frame, bbox)
-
-    fps_total = 0
-
-    f_tracked = 1
-
-    for idx in range(1, frame_length):
-        # print(idx, loop[idx])
-        cur_frame = cv2.imread(frame_list[loop[idx]])
-
-        # Check if the image is loaded and the traker is initialized
-        if (cur_frame is None) or (not ok):
-            # print("track failure", ok, cur_frame is not None, frame_list[loop[idx]])
+    # Decode the following frames in the background while the tracker is initialized and updated
+    reader = FramePrefetcher(frame_list, loop[1:], scale = scale)
+    try:
+        # Initial the tracker with the first frame
+        init_frame = read_scaled_frame(frame_list, loop[0], scale)
+        # The size of the original frame, the tracked bbox is checked in the original coordinates
+        f_height, f_width, _ = read_frame(frame_list, loop[0]).shape
+        if isinstance(tracker, TrackerSiamRPN):
+            # The exemplar kernels are reused if the track starts from the same labeled box again
+            ok = tracker.init(init_frame, bbox, frame_key = frame_key(frame_list, loop[0]))
+        else:
+            ok = tracker.init(init_frame, bbox)
+
+        yield init_bbox
+
+        for idx in range(1, frame_length):
+            # print(idx, loop[idx])
+            cur_frame = reader.read()
+
+            # Check if the image is loaded and the traker is initialized
+            if (cur_frame is None) or (not ok):
+                # print("track failure", ok, cur_frame is not None, frame_list[loop[idx]])
+                break
+
+            # Update tracker
+            ok, bbox = tracker.update(cur_frame)
+
+            # Add the tracking result to the list
+            if ok:
+                # print(idx, bbox)
+                # Scale the bbox back to the original frame
+                bbox = [x / scale for x in bbox]
+                yield (bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3])
+                if bbox[2] > f_width or bbox[3] > f_height:
+                    ok = False
+                    # print(f"The tracking bbox is larger than the image frame.")
+    finally:
+        # The generator is also closed when the caller stops early, e.g. an aborted race
+        reader.close()
+
+def siamrpnTrackerBatch(frame_lists: list, init_bboxes: list, is_inverse: list) -> list:
+    '''
+    Track several independent tracks with SiamRPN, all active tracks are advanced in one batched forward pass per frame.
+    Each track gives the same result as opencvTracker with the SIAMRPN tracker.
+    Input:
+        frame_lists: the sequence of frames to track for each track
+        init_bboxes: the initial bbox in the first frame of each track. [xtl, ytl, xbr, ybr]
+        is_inverse: whether tracking the frames of each track inversely or not
+    Output:
+        bbox_lists: the Trajectory of the tracked bboxes of each track, in the tracking order
+    '''
+    track_num = len(frame_lists)
+    trackers = []
+    loops = []
+    frame_sizes = []
+    bbox_lists = []
+    active = []
+
+    for t_idx in range(track_num):
+        frame_list = frame_lists[t_idx]
+
+        # Generate the loop list
+        frame_length = len(frame_list)
+        if is_inverse[t_idx]:
+            loop = [x for x in range(frame_length - 1, -1, -1)]
+        else:
+            loop = [x for x in range(0, frame_length)]
+
+        # Generate the initial bbox and round the number
+        xtl, ytl, xbr, ybr = init_bboxes[t_idx]
+        width = int(xbr - xtl + 0.5)
+        height = int(ybr - ytl + 0.5)
+        xtl = int(xtl + 0.5)
+        ytl = int(ytl + 0.5)
+
+        # Initial the tracker with the first frame
+        tracker = create_tracker('SIAMRPN')
+        init_frame = read_frame(frame_list, loop[0])
+        f_height, f_width, _ = init_frame.shape
+        ok = tracker.init(init_frame, (xtl, ytl, width, height), frame_key = frame_key(frame_list, loop[0]))
+
+        trackers.append(tracker)
+        loops.append(loop)
+        frame_sizes.append((f_width, f_height))
+        bbox_lists.append([init_bboxes[t_idx]])
+        active.append(ok)
+
+    idx = 1
+    while True:
+        # Read the next frame of all the active tracks
+        batch = []
+        for t_idx in range(track_num):
+            if not active[t_idx] or idx >= len(loops[t_idx]):
+                active[t_idx] = False
+                continue
+            cur_frame = read_frame(frame_lists[t_idx], loops[t_idx][idx])
+            if cur_frame is None:
+                active[t_idx] = False
+                continue
+            batch.append((t_idx, cur_frame))
+
+        if len(batch) == 0:
             break
 
-        # Start timer
-        timer = cv2.getTickCount()
-
-        # Update tracker
-        ok, bbox = tracker.update(cur_frame)
+        # Update all the active trackers in one forward pass
+        results = TrackerSiamRPN.update_batch([trackers[t_idx] for t_idx, _ in batch], [frame for _, frame in batch])
 
-        # Calculate Frames per second (FPS)
-        fps_total += cv2.getTickFrequency() / (cv2.getTickCount() - timer);
+        for (t_idx, _), (ok, bbox) in zip(batch, results):
+            if ok:
+                bbox_lists[t_idx].append((bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]))
+                f_width, f_height = frame_sizes[t_idx]
+                if bbox[2] > f_width or bbox[3] > f_height:
+                    ok = False
+            active[t_idx] = ok
 
-        # Add the tracking result to the list
-        if ok:
-            # print(idx, bbox)
-            bbox_list.append((bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]))
-            f_tracked += 1
-            if bbox[2] > f_width or bbox[3] > f_height:
-                ok = False
-                # print(f"The tracking bbox is larger than the image frame.")
+        idx += 1
 
+    return [Trajectory(x) for x in bbox_lists]
 
-    fps_average = fps_total/(f_tracked)
-    # print(f"The average tracking fps is {fps_average}. There are {f_tracked} frames are tracked including the inital frame.")
-    
-    bbox_list[0] = init_bbox
+def opencvTracker(frame_list: list, init_bbox: list, tracker_type: int or str = 0, is_inverse: bool = False, scale: float = 1.0) -> list:
+    '''
+    The function to use opencv supported trackers for tracking
+    Input:
+        tracker_type: the type of trackers to be used. The input shold be the name or the index of the following list
+                      ['BOOSTING', 'MIL','KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT'] 
+        frame_list: a list of path to the sequence of frames to track, or a lazy frame sequence (e.g. VideoFrames)
+        is_inverse: whether tracking the frames inversely or not.
+        init_bbox: the initial bbox in the first frame. [xtl, ytl, xbr, ybr]
+        scale: track on the frames resized by the scale, see track_scale
+    Output:
+        bbox_list: the Trajectory of the tracked bbox in each frame, in the tracking order. [(xtl, ytl, xbr, ybr)]
+    '''
+    bbox_list = Trajectory(list(tracker_steps(frame_list, init_bbox, tracker_type, is_inverse, scale)))
 
     return bbox_list
 
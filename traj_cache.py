@@ -0,0 +1,233 @@
+import os
+import glob
+import cv2
+import json
+import hashlib
+import threading
+import numpy as np
+from tracker import opencvTracker, tracker_name, SIAMRPN_NET_PATH
+from frame_provider import read_frame, frame_key
+from trajectory import Trajectory
+
+# Bump the version when the tracking code changes the results, so the old trajectories are not reused
+CACHE_VERSION = 3
+
+def scale_params(scale: float) -> dict:
+    '''
+    The key params of the tracking scale, the full scale keeps the keys of the trajectories tracked before
+    '''
+    return None if scale == 1.0 else {"scale": scale}
+
+class TrajectoryCache:
+    def __init__(self, cache_path: str) -> None:
+        '''
+        A persistent on-disk cache of the tracking trajectories. Each trajectory is stored as a float64 (N, 4)
+        .npy file named by the hash of (frame content hash range, tracker type, init bbox, direction, tracker params).
+        The content hash of each frame is kept in an index keyed by the file stat, so an unchanged frame is hashed once.
+        A copy sent to a worker process writes the hashes it adds into its own shard of the index, so the processes
+        never rewrite the same file. The shards are read with the index and merged into it by the main process.
+        Input:
+            cache_path: the folder to store the cache
+        '''
+        self.cache_path = cache_path
+        os.makedirs(self.cache_path, exist_ok = True)
+        self.digest_path = os.path.join(self.cache_path, "frame_digests.json")
+        self.digests = self.load_digests()
+        # The hashes added by this process, and the shard they are written to in a worker process
+        self.new_digests = {}
+        self.shard_path = None
+        self.is_dirty = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        # The digest index and the lock are not sent to the worker processes, the index is reloaded from the disk.
+        # The cache is sent once to each worker when the pool starts, see parallel.WorkerPool
+        state = self.__dict__.copy()
+        state["digests"] = None
+        state["new_digests"] = None
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.digests = self.load_digests()
+        self.new_digests = {}
+        self.shard_path = os.path.join(self.cache_path, f"frame_digests.{os.getpid()}.json")
+        self.is_dirty = False
+        self.lock = threading.Lock()
+
+    def shard_paths(self) -> list:
+        return glob.glob(os.path.join(self.cache_path, "frame_digests.*.json"))
+
+    def load_digests(self, shard_paths: list = None) -> dict:
+        '''
+        Load the index of the frame content hashes {frame: [stat stamp, hash]}, with the shards of the workers
+        Input:
+            shard_paths: the shards to be merged, default to all the shards in the cache folder
+        '''
+        digests = {}
+        if shard_paths is None:
+            shard_paths = self.shard_paths()
+        for path in [self.digest_path] + shard_paths:
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    digests.update(json.load(f))
+        return digests
+
+    def write_json(self, path: str, data: dict) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def flush(self) -> None:
+        '''
+        Write the new frame content hashes. A worker process writes them into its shard. The main process merges
+        the shards into the index, it must not run while the workers are writing, e.g. while no job is running.
+        '''
+        with self.lock:
+            if self.shard_path is not None:
+                if self.is_dirty:
+                    self.write_json(self.shard_path, self.new_digests)
+                    self.is_dirty = False
+                return
+
+            shard_paths = self.shard_paths()
+            if not self.is_dirty and len(shard_paths) == 0:
+                return
+            digests = self.load_digests(shard_paths)
+            digests.update(self.digests)
+            self.write_json(self.digest_path, digests)
+            for path in shard_paths:
+                os.remove(path)
+            self.digests = digests
+            self.new_digests = {}
+            self.is_dirty = False
+
+    def frame_digest(self, frame_list: list, idx: int) -> str:
+        '''
+        Get the content hash of a frame
+        Input:
+            frame_list: the list of path to the image frames, or a lazy frame sequence
+            idx: the index of the frame in the list
+        Output:
+            digest: the hex digest of the frame content
+        '''
+        if isinstance(frame_list, (list, tuple)):
+            path = frame_list[idx]
+            memo_key = path
+        else:
+            path, name = frame_key(frame_list, idx)
+            memo_key = f"{path}::{name}"
+
+        stat = os.stat(path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+
+        with self.lock:
+            memo = self.digests.get(memo_key)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+
+        # Hash the encoded image, or the decoded frame of a frame sequence
+        if isinstance(frame_list, (list, tuple)):
+            with open(path, "rb") as f:
+                digest = hashlib.blake2b(f.read(), digest_size = 16).hexdigest()
+        else:
+            digest = hashlib.blake2b(read_frame(frame_list, idx).tobytes(), digest_size = 16).hexdigest()
+
+        with self.lock:
+            self.digests[memo_key] = [stamp, digest]
+            self.new_digests[memo_key] = [stamp, digest]
+            self.is_dirty = True
+        return digest
+
+    def key(self, frame_list: list, init_bbox: list, track_type: int or str, is_inverse: bool = False, params: dict = None) -> str:
+        '''
+        Generate the cache key of a tracking call
+        Input:
+            frame_list, init_bbox, track_type, is_inverse: the inputs of opencvTracker
+            params: the extra tracker parameters which change the result
+        Output:
+            key: the hex digest of the key
+        '''
+        h = hashlib.blake2b(digest_size = 20)
+        for idx in range(len(frame_list)):
+            h.update(self.frame_digest(frame_list, idx).encode("ascii"))
+
+        name = tracker_name(track_type)
+        all_params = {"version": CACHE_VERSION, "cv2": cv2.__version__}
+        if name == 'SIAMRPN' and os.path.exists(SIAMRPN_NET_PATH):
+            all_params["net"] = [SIAMRPN_NET_PATH, os.stat(SIAMRPN_NET_PATH).st_mtime_ns]
+        if params is not None:
+            all_params.update(params)
+
+        h.update(json.dumps([name, [float(x) for x in init_bbox], bool(is_inverse), all_params], sort_keys = True).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> list:
+        '''
+        Load the cached trajectory
+        Input:
+            key: the key generated by key()
+        Output:
+            bbox_list: the cached Trajectory, None if it is not cached
+        '''
+        path = os.path.join(self.cache_path, key + ".npy")
+        if not os.path.exists(path):
+            with self.lock:
+                self.misses += 1
+            return None
+        bboxes = np.load(path)
+        with self.lock:
+            self.hits += 1
+        return Trajectory(bboxes)
+
+    def put(self, key: str, bbox_list: list) -> None:
+        '''
+        Store the trajectory into the cache
+        Input:
+            key: the key generated by key()
+            bbox_list: the trajectory [(xtl, ytl, xbr, ybr)]
+        '''
+        path = os.path.join(self.cache_path, key + ".npy")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(bbox_list, dtype = np.float64).reshape(-1, 4))
+        os.replace(tmp_path, path)
+
+    def track(self, frame_list: list, init_bbox: list, track_type: int or str = 0, is_inverse: bool = False, scale: float = 1.0) -> list:
+        '''
+        Same as opencvTracker, but the trajectory is loaded from the cache if it was tracked before
+        '''
+        key = self.key(frame_list, init_bbox, track_type, is_inverse, params = scale_params(scale))
+        bbox_list = self.get(key)
+        if bbox_list is None:
+            bbox_list = opencvTracker(frame_list, init_bbox, track_type, is_inverse, scale)
+            self.put(key, bbox_list)
+        return bbox_list
+
+    def counters(self) -> dict:
+        '''
+        Output:
+            counters: the hit and miss counts, which can be added up across the processes
+        '''
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def add_counters(self, counters: dict) -> None:
+        '''
+        Add the hit and miss counts of the copy of the cache in another process, e.g. a worker of the process pool
+        '''
+        with self.lock:
+            self.hits += counters["hits"]
+            self.misses += counters["misses"]
+
+    def stats(self) -> dict:
+        '''
+        Output:
+            stats: the hit and miss counts of the trajectories
+        '''
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
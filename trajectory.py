@@ -0,0 +1,234 @@
+import numpy as np
+
+def blend_tracks(ftrack: np.ndarray, btrack: np.ndarray) -> np.ndarray:
+    '''
+    Blend the forward tracking result with the backward tracking result. The weight of the forward tracking
+    decreases linearly from 1 at the first frame, the weight of the backward tracking increases from 0.
+    The inputs are not modified.
+    Input:
+        ftrack: (..., N, 4) array, the forward tracking result
+        btrack: (..., N, 4) array, the backward tracking result in the inverse order
+    Output:
+        itrack: (..., N, 4) float64 array, the blended tracking result in the forward order
+    '''
+    ftrack = np.asarray(ftrack, dtype = np.float64)
+    btrack = np.asarray(btrack, dtype = np.float64)
+    assert ftrack.shape == btrack.shape and ftrack.shape[-1] == 4, "The forward and backward tracking don't match."
+
+    frame_num = ftrack.shape[-2]
+    idx = np.arange(frame_num, dtype = np.float64)[:, None]
+    f_weight = (frame_num - idx) / frame_num
+    b_weight = idx / frame_num
+
+    # Read the backward tracking in the forward order through a reversed view
+    return ftrack * f_weight + btrack[..., ::-1, :] * b_weight
+
+def interpolate_keyframes(bbox_0: np.ndarray, bbox_1: np.ndarray, length: int) -> np.ndarray:
+    '''
+    Linear interpolation between the keyframes at the two ends of an interval
+    Input:
+        bbox_0: (..., 4) array, the bbox at the start of the interval
+        bbox_1: (..., 4) array, the bbox at the end of the interval
+        length: end - start of the interval, must be positive
+    Output:
+        bboxes: (..., length + 1, 4) float64 array, the bboxes from the start to the end (both included)
+    '''
+    bbox_0 = np.asarray(bbox_0, dtype = np.float64)[..., None, :]
+    bbox_1 = np.asarray(bbox_1, dtype = np.float64)[..., None, :]
+    weight = (np.arange(length + 1, dtype = np.float64) / length)[:, None]
+    return bbox_0 * (1 - weight) + bbox_1 * weight
+
+def interpolate_intervals(intervals: list, bboxes_0: np.ndarray, bboxes_1: np.ndarray) -> tuple:
+    '''
+    Linear interpolation of many intervals of different lengths in one call
+    Input:
+        intervals: [[start, end]], the intervals, end must be larger than start
+        bboxes_0: (M, 4) array, the bbox at the start of each interval
+        bboxes_1: (M, 4) array, the bbox at the end of each interval
+    Output:
+        frame_ids: (K,) int array, the frame ids of all intervals concatenated, the shared ends are repeated
+        bboxes: (K, 4) float64 array, the interpolated bboxes of the frame ids
+    '''
+    intervals = np.asarray(intervals, dtype = np.int64).reshape(-1, 2)
+    bboxes_0 = np.asarray(bboxes_0, dtype = np.float64).reshape(-1, 4)
+    bboxes_1 = np.asarray(bboxes_1, dtype = np.float64).reshape(-1, 4)
+    lengths = intervals[:, 1] - intervals[:, 0]
+    assert np.all(lengths > 0), "The interval is empty."
+
+    # The interval of each output frame and its offset from the start of the interval
+    owner = np.repeat(np.arange(len(intervals)), lengths + 1)
+    offset = np.arange(len(owner)) - np.repeat(np.cumsum(lengths + 1) - (lengths + 1), lengths + 1)
+
+    weight = (offset / lengths[owner])[:, None]
+    bboxes = bboxes_0[owner] * (1 - weight) + bboxes_1[owner] * weight
+    return intervals[owner, 0] + offset, bboxes
+
+def to_bbox_traj(start: int, bboxes: np.ndarray) -> dict:
+    '''
+    Convert the bboxes of the continuous frames into the bbox trajectory dict
+    Input:
+        start: the frame id of the first bbox
+        bboxes: (N, 4) array of the bboxes
+    Output:
+        bbox_traj: {frame_id: (xtl, ytl, xbr, ybr)}
+    '''
+    return dict(zip(range(start, start + len(bboxes)), map(tuple, np.asarray(bboxes).tolist())))
+
+class Trajectory:
+    def __init__(self, boxes: list = None, valid: np.ndarray = None, start: int = 0) -> None:
+        '''
+        A compact bbox trajectory over continuous frames, backed by a float64 (N, 4) array and a validity mask.
+        It can be used in place of both the list of bboxes (iterating gives the bbox of each frame, () if missing)
+        and the {frame_id: bbox} dict (indexing, "in", keys() and items() use the frame ids). Use at() to get
+        a bbox by its position like a list.
+        Input:
+            boxes: [(xtl, ytl, xbr, ybr)] where the missing bboxes are empty tuples, or an (N, 4) array
+            valid: (N,) bool array, default to the rows of boxes without NaN
+            start: the frame id of the first bbox
+        '''
+        if boxes is None:
+            boxes = np.zeros((0, 4), dtype = np.float64)
+        elif isinstance(boxes, np.ndarray):
+            boxes = boxes.astype(np.float64, copy = False).reshape(-1, 4)
+        else:
+            rows = [x if len(x) == 4 else (np.nan,) * 4 for x in boxes]
+            boxes = np.array(rows, dtype = np.float64).reshape(-1, 4)
+
+        if valid is None:
+            valid = ~np.isnan(boxes).any(axis = 1)
+        else:
+            valid = np.asarray(valid, dtype = bool)
+            assert valid.shape == (len(boxes),), "The validity mask doesn't match the bboxes."
+            # Keep the missing bboxes as NaN rows, so the array view never exposes them as real bboxes
+            if not valid.all():
+                boxes = np.where(valid[:, None], boxes, np.nan)
+
+        self.boxes = boxes
+        self.valid = valid
+        self.start = int(start)
+
+    @classmethod
+    def from_dict(cls, bbox_traj: dict) -> "Trajectory":
+        '''
+        Convert the {frame_id: bbox} dict into a trajectory over the frames from the smallest to the largest id
+        '''
+        if len(bbox_traj) == 0:
+            return cls()
+        start = min(bbox_traj)
+        boxes = np.full((max(bbox_traj) - start + 1, 4), np.nan, dtype = np.float64)
+        boxes[np.fromiter(bbox_traj.keys(), dtype = np.int64) - start] = list(bbox_traj.values())
+        return cls(boxes, start = start)
+
+    @classmethod
+    def merge(cls, trajs: list) -> "Trajectory":
+        '''
+        Merge the trajectories into one over all their frames, the later trajectories overwrite the earlier ones
+        Input:
+            trajs: the list of Trajectory or {frame_id: bbox} dict
+        Output:
+            traj: the merged trajectory
+        '''
+        trajs = [x if isinstance(x, Trajectory) else cls.from_dict(x) for x in trajs]
+        trajs = [x for x in trajs if len(x) > 0]
+        if len(trajs) == 0:
+            return cls()
+        start = min(x.start for x in trajs)
+        end = max(x.end for x in trajs)
+        boxes = np.full((end - start, 4), np.nan, dtype = np.float64)
+        valid = np.zeros(end - start, dtype = bool)
+        for traj in trajs:
+            # Only the existing bboxes overwrite
+            idx = np.flatnonzero(traj.valid) + traj.start - start
+            boxes[idx] = traj.boxes[traj.valid]
+            valid[idx] = True
+        return cls(boxes, valid, start)
+
+    @property
+    def end(self) -> int:
+        '''
+        The frame id after the last frame
+        '''
+        return self.start + len(self.boxes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.boxes.nbytes + self.valid.nbytes
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __array__(self, dtype: object = None, copy: bool = None) -> np.ndarray:
+        # The missing bboxes are NaN rows
+        return self.boxes if dtype is None else self.boxes.astype(dtype)
+
+    def __iter__(self) -> object:
+        for bbox, is_valid in zip(self.boxes.tolist(), self.valid.tolist()):
+            yield tuple(bbox) if is_valid else ()
+
+    def __contains__(self, frame_id: int) -> bool:
+        idx = frame_id - self.start
+        return 0 <= idx < len(self.boxes) and bool(self.valid[idx])
+
+    def __getitem__(self, frame_id: int or slice) -> tuple:
+        '''
+        Get the bbox of the frame id, () if it is missing. Slicing by the frame ids returns a trajectory sharing the memory.
+        '''
+        if isinstance(frame_id, slice):
+            assert frame_id.step is None or frame_id.step == 1, "Only the continuous slice is supported."
+            begin = self.start if frame_id.start is None else frame_id.start
+            end = self.end if frame_id.stop is None else frame_id.stop
+            begin = min(max(begin, self.start), self.end)
+            end = min(max(end, begin), self.end)
+            sub = object.__new__(Trajectory)
+            sub.boxes = self.boxes[begin - self.start:end - self.start]
+            sub.valid = self.valid[begin - self.start:end - self.start]
+            sub.start = begin
+            return sub
+
+        idx = frame_id - self.start
+        if idx < 0 or idx >= len(self.boxes):
+            raise IndexError("The frame id is out of the trajectory.")
+        return self.at(idx)
+
+    def at(self, pos: int) -> tuple:
+        '''
+        Get the bbox by its position in the trajectory like a list, () if it is missing. A negative position
+        counts from the last frame.
+        '''
+        if pos < -len(self.boxes) or pos >= len(self.boxes):
+            raise IndexError("The position is out of the trajectory.")
+        return tuple(self.boxes[pos].tolist()) if self.valid[pos] else ()
+
+    def get(self, frame_id: int, default: object = None) -> tuple:
+        return self[frame_id] if frame_id in self else default
+
+    def keys(self) -> list:
+        '''
+        The frame ids with a bbox
+        '''
+        return (np.flatnonzero(self.valid) + self.start).tolist()
+
+    def items(self) -> list:
+        '''
+        The (frame_id, bbox) of the frames with a bbox
+        '''
+        idx = np.flatnonzero(self.valid)
+        return list(zip((idx + self.start).tolist(), map(tuple, self.boxes[idx].tolist())))
+
+    def window(self, start: int, end: int) -> "Trajectory":
+        '''
+        Copy the trajectory into the frames [start, end), the frames out of the trajectory are missing
+        '''
+        boxes = np.full((end - start, 4), np.nan, dtype = np.float64)
+        begin = max(start, self.start)
+        stop = min(end, self.end)
+        if stop > begin:
+            boxes[begin - start:stop - start] = self.boxes[begin - self.start:stop - self.start]
+        return Trajectory(boxes, start = start)
+
+    def tolist(self) -> list:
+        '''
+        Output:
+            bboxes: [(xtl, ytl, xbr, ybr)], () for the missing bboxes
+        '''
+        return list(self)
@@ -1,6 +1,13 @@
 import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from cvat_gt_converter import GTdata
 from tracker import *
+from frame_provider import read_frame, FrameStore, build_frame_store, read_store_header, VideoFrames
+from trajectory import Trajectory, blend_tracks, to_bbox_traj
+from iou import as_boxes, iou_elementwise, volume_iou as masked_volume_iou
+from traj_cache import scale_params
+from renderer import render_result
 
 def frame_sort(elem:str) -> int:
     '''
@@ -27,7 +34,7 @@ def frame_to_vid(frame_path: str, save_path: str, img_format: str = "PNG", vid_n
     cmd = f"/usr/bin/ffmpeg -r {fps} -pattern_type glob -i '{frame_path}/*.{img_format}' -vf 'pad=ceil(iw/2)*2:ceil(ih/2)*2' -r {fps} -crf 25 -c:v libx264 -pix_fmt yuv420p -movflags +faststart {vid_path}"
     os.system(cmd)
 
-def frame_list_gen(frame_path: str, img_format: str = "PNG", start: int = 0, end: int = -1, check_num:int = -1, is_full_path:bool = True) -> list:
+def frame_list_gen(frame_path: str, img_format: str = "PNG", start: int = 0, end: int = -1, check_num:int = -1, is_full_path:bool = True, use_store:bool = False, store_path:str = None) -> list:
     '''
     Generate a list for the frame sequence path
     Input:
@@ -37,8 +44,11 @@ def frame_list_gen(frame_path: str, img_format: str = "PNG", start: int = 0, end
         end: the frame id to end, - represents to select from the end.
         check_num: if set to a positive number then check the number of frames under the folder equals to the number or not
         is_full_path: whether to store the full path or the relevant path to the frame_path
+        use_store: return a lazy frame sequence backed by a memory-mapped frame store instead of the paths.
+                   The folder is decoded into the store once, and again only if the frames in the folder change.
+        store_path: the path to the frame store file, default to <frame_path>.store next to the folder
     Output:
-        frame_list: a list of path for the image frames
+        frame_list: a list of path for the image frames, or a FrameStore if use_store is set
     '''
     frames = os.listdir(frame_path)
     format_len = len(img_format)
@@ -48,8 +58,21 @@ def frame_list_gen(frame_path: str, img_format: str = "PNG", start: int = 0, end
     if check_num>0:
         assert check_num == len(frame_list), "The number of frames is not equal to the asked number"
 
+    if use_store:
+        if store_path is None:
+            store_path = os.path.normpath(frame_path) + ".store"
+        # Decode the folder into the frame store if it doesn't exist or is out of date
+        is_stale = not os.path.exists(store_path)
+        if not is_stale:
+            store_time = os.path.getmtime(store_path)
+            is_stale = read_store_header(store_path)["frames"] != frame_list or \
+                any(os.path.getmtime(os.path.join(frame_path, x)) > store_time for x in frame_list)
+        if is_stale:
+            build_frame_store([os.path.join(frame_path, x) for x in frame_list], store_path)
+        frame_list = FrameStore(store_path)
+
     # Convert to the full path is needed
-    if is_full_path:
+    elif is_full_path:
         frame_list = [os.path.join(frame_path, x) for x in frame_list]
 
     if end < 0:
@@ -59,6 +82,25 @@ def frame_list_gen(frame_path: str, img_format: str = "PNG", start: int = 0, end
     else:
         return frame_list[start:end+1]
 
+def video_frame_list(video_path: str, start: int = 0, end: int = -1, index_path: str = None) -> VideoFrames:
+    '''
+    Generate the frame sequence decoded from a video file, used in place of the list from frame_list_gen
+    Input:
+        video_path: the path to the video file
+        start: the frame id to start
+        end: the frame id to end, - represents to select from the end.
+        index_path: the path to the index file of the video, default to <video_path>.index.json
+    Output:
+        frame_list: a VideoFrames of the selected frames
+    '''
+    frame_list = VideoFrames(video_path, index_path = index_path)
+    if end < 0:
+        end = len(frame_list) + end + 1
+    if end >= len(frame_list) - 1:
+        return frame_list[start:]
+    else:
+        return frame_list[start:end + 1]
+
 def iou_cal(gt_bbox: tuple, est_bbox: tuple) -> float:
     '''
     Calculate the iou between the gt and the tracking estimations.
@@ -68,33 +110,7 @@ def iou_cal(gt_bbox: tuple, est_bbox: tuple) -> float:
     Output:
         miou: the calculated iou over the bbox
     '''
-    # Verify if the bboxs are legel
-    # print(gt_bbox, est_bbox)
-    assert gt_bbox[2] > 0 and gt_bbox[3] > 0 and est_bbox[2] > 0 and est_bbox[3] > 0, "The bbox is illegal."
-    
-    # Calculate the intersection
-    i_xtl = max(gt_bbox[0], est_bbox[0])
-    i_ytl = max(gt_bbox[1], est_bbox[1])
-    i_xbr = min(gt_bbox[2], est_bbox[2])
-    i_ybr = min(gt_bbox[3], est_bbox[3])
-
-    # If there is no intersection
-    if i_xtl >= i_xbr or i_ytl >= i_ybr:
-        return 0.0
-
-    i_area = (i_xbr - i_xtl) * (i_ybr - i_ytl)
-
-    # Calculate the union. Union = gt_bbox + est_bbox - intersection
-    gt_area = (gt_bbox[2] - gt_bbox[0]) * (gt_bbox[3] - gt_bbox[1])
-    est_area = (est_bbox[2] - est_bbox[0]) * (est_bbox[3] - est_bbox[1])
-
-    u_area = float(gt_area + est_area - i_area)
-    iou = i_area / u_area
-
-    # Check if the iou is legal
-    assert iou >= 0.0 and iou <= 1.0, "IOU is out of range."
-
-    return iou
+    return float(iou_elementwise(gt_bbox, est_bbox)[0])
 
 def volume_iou(gt_bboxes:list, est_bboxes:list, is_inverse:bool = False) -> (float, int):
     '''
@@ -111,47 +127,34 @@ def volume_iou(gt_bboxes:list, est_bboxes:list, is_inverse:bool = False) -> (flo
     # Check if the estimated bboxes is less than the gt bboxes
     assert len(gt_bboxes) >= len(est_bboxes) and len(est_bboxes) > 0, "The number of estimated bboxes is over than the gt."
 
-    f_tracked = 0
-    iou_sum = 0
-
-    for idx in range(len(est_bboxes)):
+    gt_boxes, gt_valid = as_boxes(gt_bboxes)
+    est_boxes, _ = as_boxes(est_bboxes)
 
-        gt_bbox = gt_bboxes[-(idx+1)] if is_inverse else gt_bboxes[idx]
-        est_bbox = est_bboxes[idx]
+    # The gt bboxes paired with the estimations
+    gt_boxes = gt_boxes[::-1] if is_inverse else gt_boxes
+    gt_valid = gt_valid[::-1] if is_inverse else gt_valid
+    num = len(est_boxes)
 
-        # There is bbox in the current frame in gt
-        if len(gt_bbox) == 4:
-            f_tracked += 1
-            iou = iou_cal(gt_bbox, est_bbox)
-            iou_sum += iou
-
-    viou = iou_sum / float(f_tracked)
-    return viou, f_tracked
+    # Only the frames with the bbox in gt are counted
+    return masked_volume_iou(gt_boxes[:num], est_boxes, gt_valid[:num])
 
 def viou_gt(gt_bboxes:list, est_bboxes:dict) -> float:
     '''
     Calculate the viou between the estimation and the gt
     Input:
-        gt_bboxes: the list of gt bbox
-        est_bboxes: the dict of the estimated bbox {id:bbox}
+        gt_bboxes: the list (or Trajectory) of gt bbox
+        est_bboxes: the dict of the estimated bbox {id:bbox}, or a Trajectory
     '''
-    iou_sum = 0
-    f_tracked = 0
-    for idx in range(0, len(gt_bboxes)):
-        if len(gt_bboxes[idx]) != 4:
-            continue
-        if idx not in est_bboxes:
-            continue
-        f_tracked += 1
-        gt_bbox = gt_bboxes[idx]
-        est_bbox = est_bboxes[idx]
-        iou_sum += iou_cal(gt_bbox, est_bbox)
-    if f_tracked == 0:
-        return 0
-    else:
-        return iou_sum / f_tracked
+    gt_boxes, gt_valid = as_boxes(gt_bboxes)
+
+    # Align the estimations with the frames of the gt
+    if not isinstance(est_bboxes, Trajectory):
+        est_bboxes = Trajectory.from_dict(est_bboxes)
+    est_boxes = np.asarray(est_bboxes.window(0, len(gt_boxes)), dtype = np.float64)
+
+    return masked_volume_iou(gt_boxes, est_boxes, gt_valid & ~np.isnan(est_boxes).any(axis = 1))[0]
 
-def tracker_eval(gt:object, frame_list:list, start:int, end:int, track_type:int, obj_id:int, gt_comp:bool = True) -> tuple:
+def tracker_eval(gt:object, frame_list:list, start:int, end:int, track_type:int, obj_id:int, gt_comp:bool = True, is_concurrent:bool = False, is_batched:bool = False, traj_cache:object = None, scale:float or str = 1.0) -> tuple:
     '''
     Evaluate the tracking method on a given frame sequences with the volume iou
     Input:
@@ -161,6 +164,10 @@ def tracker_eval(gt:object, frame_list:list, start:int, end:int, track_type:int,
         track_type: the tracker used for tracking
         obj_id: the id of the object to be tracked
         gt_comp: if compare the tracker result with the annotated gt in the interval
+        is_concurrent: run the forward and the backward tracking at the same time in two threads
+        is_batched: for the SIAMRPN tracker, track both directions together with batched inference
+        traj_cache: the TrajectoryCache to reuse the trajectories tracked before, None to always track
+        scale: track on the downscaled frames, a scale in (0, 1] or "auto", see track_scale
     Output:
         viou: the volume iou between forward tracking and backward tracking
         ftrack_bbox: the bbox trajectory from forward tracking
@@ -184,10 +191,41 @@ def tracker_eval(gt:object, frame_list:list, start:int, end:int, track_type:int,
     # print(f"Tracking with the {track_type} method.")
     # print(start, init_bbox_start, end, init_bbox_end)
 
-    ftrack_bbox = opencvTracker(frame_list, init_bbox_start, track_type)
+    # The tracking function, the trajectories tracked before are loaded from the cache if it is given
+    track = opencvTracker if traj_cache is None else traj_cache.track
+
+    # The scale of each direction depends on its initial bbox
+    fscale = track_scale(scale, init_bbox_start, track_type)
+    bscale = track_scale(scale, init_bbox_end, track_type)
+
+    if is_batched and tracker_name(track_type) == 'SIAMRPN':
+        ftrack_bbox = None
+        btrack_bbox = None
+        if traj_cache is not None:
+            fkey = traj_cache.key(frame_list, init_bbox_start, track_type, params = {"batched": True})
+            bkey = traj_cache.key(frame_list, init_bbox_end, track_type, is_inverse = True, params = {"batched": True})
+            ftrack_bbox = traj_cache.get(fkey)
+            btrack_bbox = traj_cache.get(bkey)
+
+        if ftrack_bbox is None or btrack_bbox is None:
+            # Both directions are advanced in the same forward pass, the backward result is in the inverse order
+            ftrack_bbox, btrack_bbox = siamrpnTrackerBatch([frame_list, frame_list], [init_bbox_start, init_bbox_end], [False, True])
+            if traj_cache is not None:
+                traj_cache.put(fkey, ftrack_bbox)
+                traj_cache.put(bkey, btrack_bbox)
+    elif is_concurrent:
+        # The two directions are independent until they are compared. The trackers release the GIL
+        # while decoding and updating, so the threads run in parallel.
+        with ThreadPoolExecutor(max_workers = 2) as executor:
+            fjob = executor.submit(track, frame_list, init_bbox_start, track_type, scale = fscale)
+            bjob = executor.submit(track, frame_list, init_bbox_end, track_type, is_inverse = True, scale = bscale)
+            ftrack_bbox = fjob.result()
+            btrack_bbox = bjob.result()
+    else:
+        ftrack_bbox = track(frame_list, init_bbox_start, track_type, scale = fscale)
 
-    # The backward tracking, the result is in the inverse order
-    btrack_bbox = opencvTracker(frame_list, init_bbox_end, track_type, is_inverse = True)
+        # The backward tracking, the result is in the inverse order
+        btrack_bbox = track(frame_list, init_bbox_end, track_type, is_inverse = True, scale = bscale)
 
     # print(len(btrack_bbox), len(ftrack_bbox))
 
@@ -197,98 +235,176 @@ def tracker_eval(gt:object, frame_list:list, start:int, end:int, track_type:int,
 
     viou = volume_iou(ftrack_bbox, btrack_bbox)
 
-
     # if using the pre-labeled frames for evaluation
-    gt_iou_list = []
+    gt_iou, gt_num = gt_keyframe_iou(gt, obj_id, start, end, ftrack_bbox, btrack_bbox) if gt_comp else (1.0, 0)
+
+    print(f"The {track_type} method tracks successfully, the viou info is {viou[0]}, the gt_iou info is {gt_iou}, total gt num is {gt_num}")
+
+    return viou[0], ftrack_bbox, btrack_bbox, gt_iou
+
+def gt_keyframe_iou(gt:object, obj_id:int, start:int, end:int, ftrack_bbox:list, btrack_bbox:list) -> tuple:
+    '''
+    Compare the tracking result with the pre-labeled keyframes inside the interval
+    Input:
+        gt: the gt object generated from the xml file
+        obj_id: the id of the tracked object
+        start & end: the frame sequence id of the interval
+        ftrack_bbox: the bbox trajectory from forward tracking
+        btrack_bbox: the bbox trajectory from backward tracking, in the inverse order
+    Output:
+        gt_iou: the mean iou of both directions over the keyframes, 1.0 if there is no keyframe
+        gt_num: the number of keyframes in the interval
+    '''
     gt_iou = 1.0
+    gt_num = 0
 
-    if gt_comp and (end-start) > 1:
-        # loop through all frames to see if there is any pre-labeled keyframes in the interval
-        for idx in range(start+1, end):
-            
-            gt_bbox = gt.get_bbox(obj_id = obj_id, frame_id = idx)
-            # if a keyframe is detected
-            if len(gt_bbox) == 4:
-                # The forward tracking bbox
-                f_bbox = ftrack_bbox[idx - start]
+    if (end-start) > 1:
+        # The pre-labeled keyframes in the interval, only their bboxes are read
+        gt_valid = gt.keyframe_mask(obj_id, start + 1, end)
+        gt_num = int(np.count_nonzero(gt_valid))
 
-                # The backward tracking bbox
-                b_bbox = btrack_bbox[-(idx-start+1)]
+        if gt_num > 0:
+            # The forward and the backward (in the inverse order) tracking bboxes of the interior frames
+            f_boxes, _ = as_boxes(ftrack_bbox)
+            b_boxes, _ = as_boxes(btrack_bbox)
+            f_boxes = f_boxes[1:end - start]
+            b_boxes = b_boxes[::-1][1:end - start]
 
-                # Add the iou into the list
-                gt_iou_list.append(iou_cal(gt_bbox, f_bbox))
-                gt_iou_list.append(iou_cal(gt_bbox, b_bbox))
-        if len(gt_iou_list) > 0:
-            gt_iou = sum(gt_iou_list) / len(gt_iou_list)
+            gt_boxes = np.array([gt.get_bbox(obj_id, start + 1 + int(x)) for x in np.flatnonzero(gt_valid)], dtype = np.float64)
+            f_iou = iou_elementwise(gt_boxes, f_boxes[gt_valid])
+            b_iou = iou_elementwise(gt_boxes, b_boxes[gt_valid])
+            gt_iou = float(f_iou.sum() + b_iou.sum()) / (2 * gt_num)
 
-    print(f"The {track_type} method tracks successfully, the viou info is {viou[0]}, the gt_iou info is {gt_iou}, total gt num is {len(gt_iou_list)//2}")
+    return gt_iou, gt_num
 
-    return viou[0], ftrack_bbox, btrack_bbox, gt_iou
+def tracker_race_eval(gt:object, frame_list:list, start:int, end:int, track_type:int, obj_id:int, viou_thresh:float, viou_best:float = 0.0, gt_comp:bool = True, traj_cache:object = None, scale:float or str = 1.0) -> tuple:
+    '''
+    Evaluate the tracking method like tracker_eval, but track both directions frame by frame and abort the
+    tracker as soon as it can't be accepted any more. The agreement of the two directions is accumulated while
+    tracking, the tracker is aborted once its best possible viou is below viou_thresh or can't beat viou_best.
+    Input:
+        gt: the gt object generated from the xml file
+        frame_list: the frame sequences for tracking
+        start & end: the frame sequence id for tracking
+        track_type: the tracker used for tracking
+        obj_id: the id of the object to be tracked
+        viou_thresh: the minimal viou to accept the tracker
+        viou_best: the viou of the best accepted tracker so far, the tracker must beat it to be accepted
+        gt_comp: if compare the tracker result with the annotated gt in the interval
+        traj_cache: the TrajectoryCache to reuse the trajectories tracked before, only the finished races are stored
+        scale: track on the downscaled frames, a scale in (0, 1] or "auto", see track_scale
+    Output:
+        viou: the volume iou between forward tracking and backward tracking, 0.0 if aborted
+        ftrack_bbox: the Trajectory from forward tracking, partial if aborted
+        btrack_bbox: the Trajectory from backward tracking in the inverse order, partial if aborted
+        gt_iou: the iou calculated with gt keyframes, 0.0 if aborted
+        n_saved: the number of frame updates saved by aborting
+    '''
+    init_bbox_start = gt.get_bbox(obj_id = obj_id, frame_id = start)
 
-def draw_result(frame_list:list, bboxes:dict, save_path:str, add_gt:bool = False, gt:list = None, is_vid:bool = False, keyframe:list = None) -> None:
+    if end == len(frame_list) - 1:
+        frame_list = frame_list[start:]
+    else:
+        frame_list = frame_list[start:end + 1]
+
+    init_bbox_end = gt.get_bbox(obj_id = obj_id, frame_id = end)
+
+    assert len(init_bbox_start) == 4 and len(init_bbox_end) == 4
+
+    fscale = track_scale(scale, init_bbox_start, track_type)
+    bscale = track_scale(scale, init_bbox_end, track_type)
+
+    fcached = None
+    bcached = None
+    if traj_cache is not None:
+        fkey = traj_cache.key(frame_list, init_bbox_start, track_type, params = scale_params(fscale))
+        bkey = traj_cache.key(frame_list, init_bbox_end, track_type, is_inverse = True, params = scale_params(bscale))
+        fcached = traj_cache.get(fkey)
+        bcached = traj_cache.get(bkey)
+
+    if fcached is not None and bcached is not None:
+        # Replay the cached trajectories instead of tracking
+        fsteps = (x for x in fcached)
+        bsteps = (x for x in bcached)
+    else:
+        fsteps = tracker_steps(frame_list, init_bbox_start, track_type, scale = fscale)
+
+        # The backward tracking, the result is in the inverse order
+        bsteps = tracker_steps(frame_list, init_bbox_end, track_type, is_inverse = True, scale = bscale)
+
+    frame_num = len(frame_list)
+    ftrack_bbox = []
+    btrack_bbox = []
+    iou_sum = 0
+
+    for idx in range(0, frame_num):
+        f_bbox = next(fsteps, None)
+        b_bbox = next(bsteps, None)
+
+        # The number of frame updates left in both directions
+        n_saved = 2 * (frame_num - 1 - idx)
+
+        # One of the directions lost the track
+        if f_bbox is None or b_bbox is None:
+            fsteps.close()
+            bsteps.close()
+            print(f"method {track_type} can't tracking successfully, {n_saved} frame updates are saved")
+            return 0.0, Trajectory(ftrack_bbox), Trajectory(btrack_bbox), 0.0, n_saved
+
+        ftrack_bbox.append(f_bbox)
+        btrack_bbox.append(b_bbox)
+
+        # The frames are paired in the same way as volume_iou in tracker_eval
+        iou_sum += iou_cal(f_bbox, b_bbox)
+
+        # The best possible viou is reached if all the remaining frames agree perfectly
+        viou_bound = (iou_sum + (frame_num - 1 - idx)) / float(frame_num)
+        if n_saved > 0 and (viou_bound < viou_thresh or viou_bound <= viou_best):
+            fsteps.close()
+            bsteps.close()
+            print(f"method {track_type} is aborted at frame {idx} with the best possible viou {viou_bound}, {n_saved} frame updates are saved")
+            return 0.0, Trajectory(ftrack_bbox), Trajectory(btrack_bbox), 0.0, n_saved
+
+    viou = iou_sum / float(frame_num)
+    ftrack_bbox = Trajectory(ftrack_bbox)
+    btrack_bbox = Trajectory(btrack_bbox)
+
+    if traj_cache is not None and (fcached is None or bcached is None):
+        traj_cache.put(fkey, ftrack_bbox)
+        traj_cache.put(bkey, btrack_bbox)
+
+    # if using the pre-labeled frames for evaluation
+    gt_iou, gt_num = gt_keyframe_iou(gt, obj_id, start, end, ftrack_bbox, btrack_bbox) if gt_comp else (1.0, 0)
+
+    print(f"The {track_type} method tracks successfully, the viou info is {viou}, the gt_iou info is {gt_iou}, total gt num is {gt_num}")
+
+    return viou, ftrack_bbox, btrack_bbox, gt_iou, 0
+
+def draw_result(frame_list:list, bboxes:dict, save_path:str, add_gt:bool = False, gt:list = None, is_vid:bool = False, keyframe:list = None, save_frames:bool = True) -> None:
     '''
     Draw the bboxes into the frame and generate a video
     Input:
-        frame_list: the list of path to all the original frame image
-        bboxes: the dictionary to store all bboxes
+        frame_list: the list of path to all the original frame image, or a lazy frame sequence (e.g. VideoFrames)
+        bboxes: the dictionary (or Trajectory) to store all bboxes
         save_path: the path to save the result
         add_gt: add the ground truth into the frame or not. If yes, the following para need to be specified
-        gt: the gt bbox list
-        is_vid: whether convert the result into a video or not
+        gt: the gt bbox list, or the Trajectory from GTdata.get_bboxes
+        is_vid: whether convert the result into a video or not. The drawn frames are encoded directly, see render_result
         keyframe: the list of frame which belongs to the keyframe
+        save_frames: write each drawn frame as an image, always written if is_vid is not set
     '''
-    if not os.path.exists(save_path):
-        os.makedirs(save_path, exist_ok = True)
-
-    for idx in range(0,len(frame_list)):
-        frame = cv2.imread(frame_list[idx])
-        img_name = frame_list[idx].split("/")[-1]
-        img_save_path = os.path.join(save_path, img_name)
-
-        if idx in bboxes:
-            bbox = bboxes[idx]
-            p1 = (int(bbox[0]), int(bbox[1]))
-            p2 = (int(bbox[2]), int(bbox[3]))
-            cv2.rectangle(frame, p1, p2, (255,0,0), 2, 1)
-
-        if add_gt:
-            bbox = gt[idx]
-            if len(bbox) == 4:
-                p1 = (int(bbox[0]), int(bbox[1]))
-                p2 = (int(bbox[2]), int(bbox[3]))
-                cv2.rectangle(frame, p1, p2, (0,0,255), 2, 1)
-            
-        if keyframe is not None and idx in keyframe:
-            cv2.putText(frame, "Manually labeled", (100,80), cv2.FONT_HERSHEY_SIMPLEX, 0.75,(0,0,255),2)
-
-        cv2.imwrite(img_save_path, frame)
-
-    if is_vid:
-        frame_to_vid(save_path, save_path)
+    render_result(frame_list, bboxes, save_path, add_gt, gt, keyframe, is_vid = is_vid, save_frames = save_frames or not is_vid)
 
 def for_back_interpolation(ftrack: list, btrack: list) -> dict:
     '''
     Interpolate the forward tracking result with the backward tracking result
     Input:
         ftrack: the forward tracking result
-        btrack: the backward tracking result
+        btrack: the backward tracking result, in the inverse order. It is not modified.
     Output:
-        itrack: the interpolated tracking result
+        itrack: the interpolated tracking result {idx: bbox}
     '''
-    frame_num = len(ftrack)
-    btrack.reverse() 
-    # print(frame_id)
-    itrack = {}
-    for idx in range(0, frame_num):
-        f_weight = (frame_num-idx) / frame_num
-        b_weight = idx / frame_num
-        f_bbox = ftrack[idx]
-        b_bbox = btrack[idx]
-        itrack[idx] = (f_bbox[0]*f_weight + b_bbox[0]*b_weight,
-                        f_bbox[1]*f_weight + b_bbox[1]*b_weight,
-                        (f_bbox[2]*f_weight + b_bbox[2]*b_weight),
-                        (f_bbox[3]*f_weight + b_bbox[3]*b_weight))
-    return itrack
+    return to_bbox_traj(0, blend_tracks(ftrack, btrack))
     
 
 def add_keyframe(gt:object, frame_list:list, obj_id:int, frame_ids:list) -> None:
@@ -296,22 +412,25 @@ def add_keyframe(gt:object, frame_list:list, obj_id:int, frame_ids:list) -> None
     The function to add keyframes and annotations
     Input:
         gt: the ground truth data 
-        frame_list: the list of frame path
+        frame_list: the list of frame path, or a lazy frame sequence (e.g. VideoFrames)
         obj_id: the object id to be labeled
         frame_ids: the list of frame_id to be labeled
     '''
     obj_name = gt.data["labels"][obj_id]
     for frame_id in frame_ids:
-        cur_frame = cv2.imread(frame_list[frame_id])
+        cur_frame = read_frame(frame_list, frame_id)
         resize_ratio = 2
         resize_dim = (cur_frame.shape[1] * resize_ratio, cur_frame.shape[0] * resize_ratio)
         resized_frame = cv2.resize(cur_frame, resize_dim, interpolation = cv2.INTER_AREA)
         bbox = cv2.selectROI(f"frame: {frame_id} -- object: {obj_name}", resized_frame, showCrosshair = False)
         new_bbox = {}
         new_bbox[frame_id] = (bbox[0]/resize_ratio, bbox[1]/resize_ratio, (bbox[0] + bbox[2])/resize_ratio, (bbox[1] + bbox[3])/resize_ratio)
-        gt.update_xml(obj_id, new_bbox, is_save = True)
+        gt.update_xml(obj_id, new_bbox)
         cv2.destroyAllWindows()
 
+    # Write all the labeled keyframes at once
+    gt.flush()
+
 
 if __name__ == "__main__":
 